@@ -0,0 +1,67 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# chat_id -> OrderedDict of user_id -> (last_active, username), oldest activity first.
+# bot_data stays the durable store; this index only answers "who was active recently".
+_index = {}
+_lock = threading.Lock()
+
+def touch(chat_id, user_id, username, is_bot, last_active):
+    """Record activity for a user in a chat. Bots are never eligible, so they are not indexed."""
+    if is_bot:
+        return
+
+    with _lock:
+        chat = _index.get(chat_id)
+        if chat is None:
+            chat = _index[chat_id] = OrderedDict()
+
+        previous = chat.get(user_id)
+        if previous and previous[0] > last_active:
+            return
+        chat[user_id] = (last_active, username)
+        chat.move_to_end(user_id)
+
+def active_users(chat_id, since):
+    """Return [(user_id, username)] active in the chat at or after the epoch timestamp since, newest first."""
+    with _lock:
+        chat = _index.get(chat_id)
+        if not chat:
+            return []
+
+        users = []
+        # Walk back from the most recent activity and stop at the first entry before the cutoff
+        for user_id in reversed(chat):
+            last_active, username = chat[user_id]
+            if last_active < since:
+                break
+            users.append((user_id, username))
+        return users
+
+def prune(before):
+    """Drop entries with activity older than the epoch timestamp before and return how many were removed."""
+    removed = 0
+    with _lock:
+        for chat_id in list(_index):
+            chat = _index[chat_id]
+            while chat:
+                user_id = next(iter(chat))
+                if chat[user_id][0] >= before:
+                    break
+                del chat[user_id]
+                removed += 1
+            if not chat:
+                del _index[chat_id]
+    return removed
+
+def seed(rows):
+    """Load (chat_id, user_id, username, last_active, is_bot) rows, which must be ordered by last_active."""
+    count = 0
+    for chat_id, user_id, username, last_active, is_bot in rows:
+        touch(chat_id, user_id, username, is_bot, last_active)
+        count += 1
+    logger.info(f"Activity index seeded with {count} rows across {len(_index)} chats.")
+    return count
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from itertools import combinations
+from typing import NamedTuple
+from eth_abi import decode, encode
+from web3 import Web3
+from dotenv import load_dotenv
+from chain import run_blocking, WAVAX_ADDRESS
+from head import add_head_listener, HEAD_MAX_STALENESS
+from multicall import aggregate
+from tokens import list_tokens
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Uniswap V2-style factory behind the router (Trader Joe V1 on Avalanche) and its swap fee
+FACTORY_ADDRESS = Web3.to_checksum_address(os.getenv('FACTORY_ADDRESS', '0x9Ad6C38BE94206cA50bb0d90783181662f0Cfa10'))
+AMM_FEE_NUMERATOR = int(os.getenv('AMM_FEE_NUMERATOR', '997'))  # Amount kept after the fee, out of AMM_FEE_DENOMINATOR
+AMM_FEE_DENOMINATOR = int(os.getenv('AMM_FEE_DENOMINATOR', '1000'))
+AMM_MAX_STALENESS = float(os.getenv('AMM_MAX_STALENESS', str(HEAD_MAX_STALENESS)))  # Older reserves are not quoted from
+# Extra tokens tracked as intermediate hops for routing, comma-separated (USDC by default)
+AMM_BASE_TOKENS = [Web3.to_checksum_address(address.strip())
+                   for address in os.getenv('AMM_BASE_TOKENS', '0xB97EF9Ef8734C71904D8002F8b6Bc66Dd9c48a6E').split(',') if address.strip()]
+
+# Selectors for the factory and pair functions the engine reads
+GET_PAIR_SELECTOR = bytes.fromhex('e6a43905')  # getPair(address,address)
+TOKEN0_SELECTOR = bytes.fromhex('0dfe1681')  # token0()
+GET_RESERVES_SELECTOR = bytes.fromhex('0902f1ac')  # getReserves()
+
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'
+
+class Pair(NamedTuple):
+    address: str
+    token0: str
+    token1: str
+
+class QuoteUnavailable(Exception):
+    """The engine has no fresh reserves for a pair on the requested path."""
+
+_pairs = {}  # frozenset({token_a, token_b}) -> Pair
+_reserves = {}  # pair address -> (reserve0, reserve1)
+_reserves_block = None
+_reserves_at = 0.0  # time.monotonic() of the last refresh
+_lock = threading.Lock()
+_refresh_task = None
+
+def _pair_key(token_a, token_b):
+    return frozenset((Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)))
+
+def default_token_pairs():
+    """Every combination of the registered tokens, WAVAX and AMM_BASE_TOKENS."""
+    addresses = list(dict.fromkeys([token.address for token in list_tokens()] + [WAVAX_ADDRESS] + AMM_BASE_TOKENS))
+    return list(combinations(addresses, 2))
+
+def tracked_pairs():
+    """Pairs the engine currently resolves and refreshes."""
+    return list(_pairs.values())
+
+def load_pairs(token_pairs=None):
+    """Resolve pair contracts for token_pairs through the factory, two Multicall3 calls in total."""
+    global _pairs
+    token_pairs = [(Web3.to_checksum_address(a), Web3.to_checksum_address(b)) for a, b in (token_pairs or default_token_pairs())]
+    results = aggregate([(FACTORY_ADDRESS, GET_PAIR_SELECTOR + encode(['address', 'address'], [a, b])) for a, b in token_pairs])
+
+    found = []
+    for (token_a, token_b), (success, data) in zip(token_pairs, results):
+        pair_address = Web3.to_checksum_address(decode(['address'], data)[0]) if success and len(data) >= 32 else ZERO_ADDRESS
+        if pair_address == ZERO_ADDRESS:
+            logger.warning(f"No pair found for {token_a}/{token_b}.")
+            continue
+        found.append((token_a, token_b, pair_address))
+
+    results = aggregate([(pair_address, TOKEN0_SELECTOR) for token_a, token_b, pair_address in found]) if found else []
+    pairs = {}
+    for (token_a, token_b, pair_address), (success, data) in zip(found, results):
+        if not success or len(data) < 32:
+            logger.warning(f"Could not read token0 of pair {pair_address}.")
+            continue
+        token0 = Web3.to_checksum_address(decode(['address'], data)[0])
+        token1 = token_b if token0 == token_a else token_a
+        pairs[_pair_key(token_a, token_b)] = Pair(pair_address, token0, token1)
+
+    with _lock:
+        _pairs = pairs
+    logger.info(f"AMM engine tracking {len(pairs)} pairs.")
+    return pairs
+
+def refresh_reserves(block_number=None):
+    """Read getReserves() for every tracked pair in one Multicall3 call.
+
+    Reads use 'latest' rather than block_number so a pool endpoint that is a block behind still answers.
+    """
+    global _reserves, _reserves_block, _reserves_at
+    pairs = list(_pairs.values())
+    if not pairs:
+        return
+    results = aggregate([(pair.address, GET_RESERVES_SELECTOR) for pair in pairs])
+
+    reserves = {}
+    for pair, (success, data) in zip(pairs, results):
+        if success and len(data) >= 96:
+            reserve0, reserve1, _ = decode(['uint112', 'uint112', 'uint32'], data)
+            reserves[pair.address] = (reserve0, reserve1)
+    with _lock:
+        _reserves = reserves
+        _reserves_block = block_number
+        _reserves_at = time.monotonic()
+
+def get_amount_out(amount_in, reserve_in, reserve_out):
+    """Constant-product output for amount_in, fee included, with the router's integer rounding."""
+    if amount_in <= 0 or reserve_in <= 0 or reserve_out <= 0:
+        raise QuoteUnavailable("Insufficient input amount or liquidity")
+    amount_in_with_fee = amount_in * AMM_FEE_NUMERATOR
+    return (amount_in_with_fee * reserve_out) // (reserve_in * AMM_FEE_DENOMINATOR + amount_in_with_fee)
+
+def get_amount_in(amount_out, reserve_in, reserve_out):
+    """Input needed for amount_out, fee included, with the router's integer rounding."""
+    if amount_out <= 0 or reserve_in <= 0 or reserve_out <= amount_out:
+        raise QuoteUnavailable("Insufficient output amount or liquidity")
+    return (reserve_in * amount_out * AMM_FEE_DENOMINATOR) // ((reserve_out - amount_out) * AMM_FEE_NUMERATOR) + 1
+
+def _reserves_for(token_in, token_out):
+    """(reserve_in, reserve_out) for a hop, or QuoteUnavailable if the pair is unknown or its reserves are stale."""
+    if time.monotonic() - _reserves_at > AMM_MAX_STALENESS:
+        raise QuoteUnavailable("Reserves are stale")
+    pair = _pairs.get(_pair_key(token_in, token_out))
+    reserves = _reserves.get(pair.address) if pair else None
+    if reserves is None:
+        raise QuoteUnavailable(f"No reserves for {token_in}/{token_out}")
+    reserve0, reserve1 = reserves
+    return (reserve0, reserve1) if Web3.to_checksum_address(token_in) == pair.token0 else (reserve1, reserve0)
+
+def get_amounts_out(amount_in, path):
+    """Local equivalent of router.getAmountsOut(amount_in, path)."""
+    amounts = [int(amount_in)]
+    for token_in, token_out in zip(path, path[1:]):
+        amounts.append(get_amount_out(amounts[-1], *_reserves_for(token_in, token_out)))
+    return amounts
+
+def get_amounts_in(amount_out, path):
+    """Local equivalent of router.getAmountsIn(amount_out, path)."""
+    amounts = [int(amount_out)]
+    for token_in, token_out in reversed(list(zip(path, path[1:]))):
+        amounts.insert(0, get_amount_in(amounts[0], *_reserves_for(token_in, token_out)))
+    return amounts
+
+def get_mid_price(path):
+    """Price of one smallest unit of path[0] in smallest units of path[-1] at the cached reserves, before fees and price impact."""
+    price = Decimal(1)
+    for token_in, token_out in zip(path, path[1:]):
+        reserve_in, reserve_out = _reserves_for(token_in, token_out)
+        if reserve_in <= 0 or reserve_out <= 0:
+            raise QuoteUnavailable("Insufficient liquidity")
+        price *= Decimal(reserve_out) / Decimal(reserve_in)
+    return price
+
+def _on_new_head(snapshot):
+    """Refresh reserves in the background for each new block, skipping blocks while a refresh is running."""
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        return
+    _refresh_task = asyncio.ensure_future(_refresh_async(snapshot.number))
+
+async def _refresh_async(block_number):
+    try:
+        await run_blocking(refresh_reserves, block_number)
+    except Exception as e:
+        logger.error(f"Error refreshing pair reserves: {e}")
+
+async def start_amm(application=None):
+    """Discover pairs, load their reserves and refresh them on every new head; usable as a post_init hook."""
+    try:
+        await run_blocking(load_pairs)
+        await run_blocking(refresh_reserves)
+    except Exception as e:
+        logger.error(f"Error starting the AMM engine: {e}. Quotes will use the router.")
+    add_head_listener(_on_new_head)
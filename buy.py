@@ -1,20 +1,24 @@
+import asyncio
 import logging
 from decimal import Decimal
 from telegram import Update
 from telegram.ext import CallbackContext
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from dotenv import load_dotenv
 import os
-import json
-from utils_token import get_user_wallet, update_leaderboard, fetch_token_price_in_avax, format_amount, get_token_contract
+from chain import web3, router_contract, run_blocking, WAVAX_ADDRESS
+from preflight import buy_preflight, PreflightError
+from head import get_head
+from nonces import prime_nonce, send_transaction
+from receipts import notify_on_receipts
+from utils_token import get_user_wallet, update_leaderboard, format_amount, fetch_token_price_in_avax
+from tokens import get_token
+from routing import best_route
 
 # Load environment variables from .env
 load_dotenv()
 
 # Get environment variables
-RPC_URL = os.getenv('AVALANCHE_RPC')
-ROUTER_CONTRACT_ADDRESS = os.getenv('ROUTER_CONTRACT_ADDRESS')
 MAIN_WALLET_ADDRESS = os.getenv('MAIN_WALLET_ADDRESS')
 
 # Define constants for token operations and fees
@@ -26,13 +30,6 @@ SLIPPAGE_TOLERANCE = Decimal('0.05')  # 5% slippage tolerance
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Connect to the blockchain
-web3 = Web3(Web3.HTTPProvider(RPC_URL))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-# Initialize the router contract
-router_contract = web3.eth.contract(address=ROUTER_CONTRACT_ADDRESS, abi=json.loads(os.getenv('ROUTER_ABI', '[]')))
-
 async def buy(update: Update, context: CallbackContext) -> None:
     """Handles the /buy command to purchase tokens using AVAX."""
     
@@ -49,8 +46,9 @@ async def buy(update: Update, context: CallbackContext) -> None:
         return
 
     try:
-        # Get the token contract and ABI
-        token_contract_address, token_abi = get_token_contract(token)
+        # Look up the token and the RPEPE fee token in the registry
+        token_info = get_token(token)
+        fee_token = get_token('rpepe')
     except ValueError as e:
         logger.error(f"Error: {e}")
         await update.message.reply_text(str(e))
@@ -68,33 +66,48 @@ async def buy(update: Update, context: CallbackContext) -> None:
         user_wallet_address = user_wallet['address']
         user_private_key = user_wallet['private_key']
 
-        # Check user's token balance for determining the fee
-        rpepe_contract = web3.eth.contract(address=os.getenv('RPEPE_TOKEN_CONTRACT_ADDRESS'), abi=json.loads(os.getenv('TOKEN_ABI_RPEPE', '[]')))
-        rpepe_balance = Decimal(rpepe_contract.functions.balanceOf(user_wallet_address).call())
+        # Fetch the fee-token balance, AVAX balance and nonce in one JSON-RPC batch; the token price is
+        # quoted from cached pair reserves and gas price and head timestamp come from the cached head snapshot
+        try:
+            preflight, token_price_in_avax, head = await asyncio.gather(
+                run_blocking(buy_preflight, fee_token.address, user_wallet_address),
+                run_blocking(fetch_token_price_in_avax, token_info),
+                get_head()
+            )
+        except PreflightError as e:
+            logger.error(f"Buy preflight failed for {token}: {e}")
+            await update.message.reply_text(f"Could not check your balances before buying: {e}.")
+            return
+        rpepe_balance = Decimal(preflight.fee_token_balance)
+        avax_balance_wei = preflight.avax_balance
+        current_gas_price = head.gas_price
 
         # Determine the fee rate
         fee_rate = LOW_FEE_RATE if rpepe_balance >= Decimal(os.getenv('MINIMUM_RPEPE_BALANCE', '4206900000')) else HIGH_FEE_RATE
 
         # Get AVAX balance of the user
-        avax_balance_wei = web3.eth.get_balance(user_wallet_address)
         avax_balance = Decimal(web3.from_wei(avax_balance_wei, 'ether'))
 
-        # Fetch token price in AVAX and calculate amount needed
-        token_price_in_avax = fetch_token_price_in_avax(token_contract_address)
+        # Calculate amount needed in AVAX
         amount_in_avax = amount * token_price_in_avax
 
         # Calculate the fee and the total AVAX needed
         fee_amount = amount_in_avax * fee_rate
         total_amount_needed = amount_in_avax + fee_amount
 
+        # Pick the route from AVAX with the best output for this amount
+        path, _ = await run_blocking(best_route, Web3.to_wei(amount_in_avax, 'ether'), WAVAX_ADDRESS, token_info.address)
+
         # Estimate gas cost
-        current_gas_price = web3.eth.gas_price
-        gas_estimate = router_contract.functions.swapExactAVAXForTokens(
-            int(Web3.to_wei(amount * (1 - SLIPPAGE_TOLERANCE), 'ether')),
-            [web3.to_checksum_address('0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7'), token_contract_address],
+        swap_function = router_contract.functions.swapExactAVAXForTokens(
+            int(amount * (1 - SLIPPAGE_TOLERANCE) * (10 ** token_info.decimals)),
+            path,
             web3.to_checksum_address(user_wallet_address),
-            int((web3.eth.get_block('latest')['timestamp']) + 10 * 60)
-        ).estimate_gas({'from': user_wallet_address, 'value': Web3.to_wei(amount_in_avax, 'ether')})
+            int(head.timestamp + 10 * 60)
+        )
+        gas_estimate = await run_blocking(
+            swap_function.estimate_gas, {'from': user_wallet_address, 'value': Web3.to_wei(amount_in_avax, 'ether')}
+        )
 
         gas_cost = Decimal(web3.from_wei(gas_estimate * current_gas_price, 'ether'))
 
@@ -105,33 +118,26 @@ async def buy(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text("Insufficient AVAX balance for transaction, including gas fees.")
             return
 
-        # Build transaction to buy the token
-        transaction = router_contract.functions.swapExactAVAXForTokens(
-            int(Web3.to_wei(amount * (1 - SLIPPAGE_TOLERANCE), 'ether')),
-            [web3.to_checksum_address('0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7'), token_contract_address],
-            web3.to_checksum_address(user_wallet_address),
-            int((web3.eth.get_block('latest')['timestamp']) + 10 * 60)
-        ).build_transaction({
+        # Build, sign and send the transaction to buy the token with the next nonce for this wallet
+        prime_nonce(user_wallet_address, preflight.nonce)
+        tx_hash = await send_transaction(user_wallet_address, lambda nonce: swap_function.build_transaction({
             'from': web3.to_checksum_address(user_wallet_address),
             'value': Web3.to_wei(amount_in_avax, 'ether'),
             'gas': gas_estimate,
             'gasPrice': current_gas_price,
-            'nonce': web3.eth.get_transaction_count(user_wallet_address),
+            'nonce': nonce,
             'chainId': 43114
-        })
-
-        # Sign and send the transaction
-        signed_txn = web3.eth.account.sign_transaction(transaction, private_key=user_private_key)
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
+        }), user_private_key)
 
         # Log and notify the user
         formatted_amount = format_amount(amount, token)
         formatted_amount_avax = format_amount(amount_in_avax, 'avax')
         logger.info(f"User {update.message.from_user.username or user_id} bought {formatted_amount} {token.upper()} for {formatted_amount_avax} AVAX with fee {fee_amount} AVAX")
-        await update.message.reply_text(
+        message = await update.message.reply_text(
             f'Transaction sent! You purchased {formatted_amount} {token.upper()} for {formatted_amount_avax} AVAX. [View on Snowtrace](https://snowtrace.io/tx/0x{tx_hash.hex()})',
             parse_mode='Markdown'
         )
+        await notify_on_receipts(message, [tx_hash], f"Your purchase of {formatted_amount} {token.upper()}")
 
         # Update the leaderboard
         username = update.message.from_user.username or f"User {user_id}"
@@ -0,0 +1,56 @@
+import logging
+import os
+from dotenv import load_dotenv
+from cache import TTLCache
+from head import add_head_listener, current_head, HEAD_POLL_INTERVAL
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Read-through cache for eth_call results, keyed by the head block they were read at
+CALL_CACHE_SIZE = int(os.getenv('CALL_CACHE_SIZE', '2048'))  # Cached responses kept at most
+CALL_CACHE_MAX_HEAD_AGE = float(os.getenv('CALL_CACHE_MAX_HEAD_AGE', str(2 * HEAD_POLL_INTERVAL)))  # Older heads bypass the cache
+
+# Entries for a block are useless once a newer head is seen, so the TTL only bounds a stalled tracker
+_cache = TTLCache(maxsize=CALL_CACHE_SIZE, ttl=max(CALL_CACHE_MAX_HEAD_AGE, 1))
+
+def _block_key(block_identifier):
+    """Map an eth_call block parameter to a cacheable block number, or None if it should not be cached."""
+    if block_identifier == 'latest':
+        head = current_head()
+        if head is None or head.age > CALL_CACHE_MAX_HEAD_AGE:
+            return None
+        return head.number
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str) and block_identifier.startswith('0x'):
+        return int(block_identifier, 16)
+    return None  # 'pending', 'earliest', block hashes
+
+def eth_call_cache_middleware(make_request, w3):
+    """Web3 middleware serving repeated eth_calls within one block from memory."""
+    def middleware(method, params):
+        if method != 'eth_call' or len(params) > 2:
+            return make_request(method, params)
+
+        transaction = params[0]
+        block_number = _block_key(params[1] if len(params) > 1 else 'latest')
+        if block_number is None:
+            return make_request(method, params)
+
+        key = (transaction.get('to'), transaction.get('data'), transaction.get('from'), block_number)
+        response = _cache.get(key)
+        if response is None:
+            response = make_request(method, params)
+            if 'error' not in response:
+                _cache.set(key, response)
+        return response
+    return middleware
+
+def install(w3):
+    """Add the eth_call cache to a Web3 instance and drop cached results on every new head."""
+    w3.middleware_onion.add(eth_call_cache_middleware, name='eth_call_cache')
+    add_head_listener(lambda snapshot: _cache.clear())
+    logger.info(f"eth_call cache installed ({CALL_CACHE_SIZE} entries).")
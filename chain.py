@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from web3.middleware import geth_poa_middleware
+from rpc_pool import RPCPool, PooledProvider, HEDGED_METHODS
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Environment variables for the RPC nodes and DEX router
+AVALANCHE_RPC = os.getenv('AVALANCHE_RPC')  # One URL or a comma-separated list
+RPC_ENDPOINTS = [url.strip() for url in (AVALANCHE_RPC or '').split(',') if url.strip()]
+ROUTER_CONTRACT_ADDRESS = os.getenv('ROUTER_CONTRACT_ADDRESS')
+ROUTER_ABI = json.loads(os.getenv('ROUTER_ABI', '[]'))
+
+# Wrapped AVAX, the quote asset of every router path
+WAVAX_ADDRESS = Web3.to_checksum_address(os.getenv('WAVAX_ADDRESS', '0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7'))
+
+# HTTP tuning for the RPC connection pool
+RPC_POOL_SIZE = int(os.getenv('RPC_POOL_SIZE', '20'))  # Keep-alive connections to the RPC node
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', '10'))  # Seconds per request
+RPC_CONNECT_RETRIES = int(os.getenv('RPC_CONNECT_RETRIES', '2'))  # Only connection errors are retried
+RPC_WORKERS = int(os.getenv('RPC_WORKERS', str(RPC_POOL_SIZE)))  # Threads running blocking web3 calls
+
+# Endpoint health and hedging
+RPC_EJECT_AFTER = int(os.getenv('RPC_EJECT_AFTER', '3'))  # Consecutive failures before an endpoint is skipped
+RPC_EJECT_SECONDS = float(os.getenv('RPC_EJECT_SECONDS', '30'))  # How long an ejected endpoint is skipped
+RPC_HEDGE_DELAY = float(os.getenv('RPC_HEDGE_DELAY', '0.25'))  # Hedge delay until an endpoint has a measured p95
+
+def _build_session():
+    """Create a requests session with a keep-alive pool sized for concurrent handlers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max(1, len(RPC_ENDPOINTS)), pool_maxsize=RPC_POOL_SIZE, max_retries=RPC_CONNECT_RETRIES)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Shared Web3 instance used by every module; requests go to the healthiest endpoint in the pool
+session = _build_session()
+rpc_pool = RPCPool(RPC_ENDPOINTS, session, RPC_TIMEOUT, eject_after=RPC_EJECT_AFTER,
+                   eject_seconds=RPC_EJECT_SECONDS, hedge_delay=RPC_HEDGE_DELAY, hedge_workers=2 * RPC_WORKERS)
+web3 = Web3(PooledProvider(rpc_pool))
+web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+# Check if Web3 is connected to the Avalanche network
+if not web3.is_connected():
+    logger.error("Failed to connect to Avalanche network via Web3. Check your RPC URL(s).")
+else:
+    logger.info(f"Successfully connected to Avalanche network via Web3 ({len(RPC_ENDPOINTS)} RPC endpoint(s)).")
+
+# Shared router contract
+router_contract = web3.eth.contract(address=ROUTER_CONTRACT_ADDRESS, abi=ROUTER_ABI)
+
+# Bounded pool for blocking web3 calls made from async handlers
+_executor = ThreadPoolExecutor(max_workers=RPC_WORKERS, thread_name_prefix='rpc')
+
+class RPCError(Exception):
+    """Error returned by the RPC node for a single request in a batch."""
+
+def batch_request(calls):
+    """Send [(method, params)] to the RPC pool as one JSON-RPC batch.
+
+    Results come back in call order; a request that failed is returned as an RPCError instance
+    instead of raising, so callers can decide which failures are fatal. Batches of read-only calls
+    are hedged like single reads.
+    """
+    payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params} for i, (method, params) in enumerate(calls)]
+    hedge = all(method in HEDGED_METHODS for method, params in calls)
+    replies = json.loads(rpc_pool.post(json.dumps(payload).encode(), hedge=hedge))
+    if not isinstance(replies, list):
+        # The node rejected the batch as a whole
+        raise RPCError(replies.get('error', replies))
+
+    replies_by_id = {reply.get('id'): reply for reply in replies}
+    results = []
+    for i, (method, params) in enumerate(calls):
+        reply = replies_by_id.get(i)
+        if reply is None:
+            results.append(RPCError(f"No response for {method}"))
+        elif reply.get('error'):
+            results.append(RPCError(f"{method}: {reply['error'].get('message', reply['error'])}"))
+        else:
+            results.append(reply.get('result'))
+    return results
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking web3 call in the RPC thread pool so the event loop keeps processing updates."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,69 @@
+import logging
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# SQLite Database paths
+DB_PATH = 'bot_data.db'
+WALLETS_DB_PATH = 'wallets.db'
+
+# Connection tuning
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '16384'))  # Page cache per connection
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))  # Seconds to wait on a locked database
+SQLITE_CACHED_STATEMENTS = 256  # Prepared statements kept per connection
+
+# One long-lived connection per database per thread
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0  # Bumped by close_all() so threads drop their closed connections
+
+def _open_connection(path):
+    """Open a connection in WAL mode with the bot's pragmas applied."""
+    conn = sqlite3.connect(
+        path,
+        timeout=SQLITE_BUSY_TIMEOUT,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        check_same_thread=False  # Only so close_all() can close it from the shutdown thread
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    logger.debug(f"Opened SQLite connection to {path} in WAL mode.")
+    return conn
+
+def get_connection(path):
+    """Return the calling thread's long-lived connection to the database at path."""
+    if getattr(_local, 'generation', None) != _generation:
+        _local.connections = {}
+        _local.generation = _generation
+
+    connections = _local.connections
+    conn = connections.get(path)
+    if conn is None:
+        conn = _open_connection(path)
+        connections[path] = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_all():
+    """Close every connection opened by get_connection, e.g. on shutdown."""
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error closing SQLite connection: {e}")
+    logger.info(f"Closed {len(connections)} SQLite connection(s).")
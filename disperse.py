@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from web3 import Web3
+from dotenv import load_dotenv
+from chain import web3, run_blocking
+from nonces import send_transaction, BroadcastUnknown
+from receipts import watch_transaction
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Disperse-style batch-transfer contract; rain falls back to one transfer per recipient when unset
+DISPERSE_CONTRACT_ADDRESS = os.getenv('DISPERSE_CONTRACT_ADDRESS')
+DISPERSE_MAX_GAS = int(os.getenv('DISPERSE_MAX_GAS', '7000000'))  # Gas budget per batch, well under the C-Chain block limit
+DISPERSE_GAS_PER_RECIPIENT = int(os.getenv('DISPERSE_GAS_PER_RECIPIENT', '40000'))  # Used to size batches
+DISPERSE_BASE_GAS = 60000  # Fixed cost of a disperse call
+APPROVAL_WAIT_TIME = 180  # Seconds to wait for the one-time approval to be mined
+DISPERSE_CONFIRM_TIMEOUT = int(os.getenv('DISPERSE_CONFIRM_TIMEOUT', '60'))  # Seconds to wait for batches to be mined
+
+# Only the Disperse functions the bot uses
+DISPERSE_ABI = [
+    {
+        'name': 'disperseToken',
+        'type': 'function',
+        'stateMutability': 'nonpayable',
+        'inputs': [
+            {'name': 'token', 'type': 'address'},
+            {'name': 'recipients', 'type': 'address[]'},
+            {'name': 'values', 'type': 'uint256[]'}
+        ],
+        'outputs': []
+    }
+]
+
+disperse_contract = (web3.eth.contract(address=Web3.to_checksum_address(DISPERSE_CONTRACT_ADDRESS), abi=DISPERSE_ABI)
+                     if DISPERSE_CONTRACT_ADDRESS else None)
+
+def disperse_enabled():
+    return disperse_contract is not None
+
+def chunk_size():
+    """Number of recipients per disperse call that stays within DISPERSE_MAX_GAS."""
+    return max(1, (DISPERSE_MAX_GAS - DISPERSE_BASE_GAS) // DISPERSE_GAS_PER_RECIPIENT)
+
+async def ensure_allowance(token_contract, owner_address, private_key, amount, gas_price):
+    """Approve the disperse contract once for the maximum amount if the current allowance is too low."""
+    allowance = await run_blocking(token_contract.functions.allowance(owner_address, disperse_contract.address).call)
+    if allowance >= amount:
+        return
+
+    approve_function = token_contract.functions.approve(disperse_contract.address, 2**256 - 1)
+    gas_estimate = await run_blocking(approve_function.estimate_gas, {'from': owner_address})
+    tx_hash = await send_transaction(owner_address, lambda nonce: approve_function.build_transaction({
+        'from': owner_address,
+        'gas': int(gas_estimate * 1.2),
+        'gasPrice': gas_price,
+        'nonce': nonce,
+        'chainId': 43114
+    }), private_key)
+    logger.info(f"Disperse approval sent for {token_contract.address}: {tx_hash.hex()}")
+
+    receipt = await (await watch_transaction(tx_hash, timeout=APPROVAL_WAIT_TIME))
+    if receipt is None or receipt.status != 1:
+        raise Exception("Disperse approval transaction failed or was reverted.")
+
+async def disperse_token(token_contract, sender_address, private_key, recipient_addresses, amount_each, gas_price):
+    """Send amount_each to every recipient through the disperse contract.
+
+    Recipients are split into batches that fit DISPERSE_MAX_GAS; batches use consecutive nonces and are
+    broadcast without waiting for each other, then their receipts are awaited together.
+    Returns (tx_hashes, undelivered_addresses, unconfirmed_addresses):
+    - tx_hashes: batches mined successfully.
+    - undelivered_addresses: recipients certainly not paid, because their batch was never broadcast or
+      reverted on-chain; the caller can retry them.
+    - unconfirmed_addresses: recipients of batches that may have been broadcast but were not mined within
+      DISPERSE_CONFIRM_TIMEOUT; retrying them could pay twice.
+    """
+    sender_address = Web3.to_checksum_address(sender_address)
+    recipient_addresses = [Web3.to_checksum_address(address) for address in recipient_addresses]
+    try:
+        await ensure_allowance(token_contract, sender_address, private_key, amount_each * len(recipient_addresses), gas_price)
+    except Exception as e:
+        logger.error(f"Error approving the disperse contract: {e}")
+        return [], recipient_addresses, []
+
+    sent = []  # (tx_hash, chunk)
+    undelivered = []
+    size = chunk_size()
+    for start in range(0, len(recipient_addresses), size):
+        chunk = recipient_addresses[start:start + size]
+        try:
+            disperse_function = disperse_contract.functions.disperseToken(token_contract.address, chunk, [amount_each] * len(chunk))
+            gas_estimate = await run_blocking(disperse_function.estimate_gas, {'from': sender_address})
+            tx_hash = await send_transaction(sender_address, lambda nonce: disperse_function.build_transaction({
+                'from': sender_address,
+                'gas': int(gas_estimate * 1.2),
+                'gasPrice': gas_price,
+                'nonce': nonce,
+                'chainId': 43114
+            }), private_key)
+        except BroadcastUnknown as e:
+            # Wait for this batch like any other instead of paying its recipients again
+            logger.error(f"{e}; not sending the {len(recipient_addresses) - start - len(chunk)} recipients after it by disperse.")
+            sent.append((e.tx_hash, chunk))
+            undelivered = recipient_addresses[start + len(chunk):]
+            break
+        except Exception as e:
+            logger.error(f"Error dispersing to {len(recipient_addresses) - start} recipients: {e}")
+            undelivered = recipient_addresses[start:]
+            break
+        logger.info(f"Dispersed {amount_each} to {len(chunk)} recipients in {tx_hash.hex()}")
+        sent.append((tx_hash, chunk))
+
+    # A broadcast batch only paid anyone once it is mined without reverting
+    watches = [await watch_transaction(tx_hash, timeout=DISPERSE_CONFIRM_TIMEOUT) for tx_hash, chunk in sent]
+    receipts = await asyncio.gather(*watches)
+    tx_hashes = []
+    unconfirmed = []
+    for (tx_hash, chunk), receipt in zip(sent, receipts):
+        if receipt is None:
+            logger.error(f"Disperse batch {tx_hash.hex()} was not mined within {DISPERSE_CONFIRM_TIMEOUT}s.")
+            unconfirmed.extend(chunk)
+        elif receipt.status != 1:
+            logger.error(f"Disperse batch {tx_hash.hex()} reverted; {len(chunk)} recipients were not paid.")
+            undelivered.extend(chunk)
+        else:
+            tx_hashes.append(tx_hash)
+    return tx_hashes, undelivered, unconfirmed
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from typing import NamedTuple
+from dotenv import load_dotenv
+from chain import batch_request, run_blocking, RPCError
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Head polling; C-Chain produces a block roughly every two seconds
+HEAD_POLL_INTERVAL = float(os.getenv('HEAD_POLL_INTERVAL', '2'))  # Seconds between polls
+HEAD_MAX_STALENESS = float(os.getenv('HEAD_MAX_STALENESS', '10'))  # Older snapshots are refreshed before use
+
+class HeadSnapshot(NamedTuple):
+    number: int
+    timestamp: int
+    gas_price: int
+    fetched_at: float  # time.monotonic() when the snapshot was taken
+
+    @property
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+_snapshot = None
+_refresh = None  # In-flight refresh shared by concurrent callers
+_poll_task = None
+_listeners = []  # Called with each snapshot that carries a newer block
+
+def fetch_head():
+    """Fetch the latest block and the gas price in one JSON-RPC batch."""
+    block, gas_price = batch_request([('eth_getBlockByNumber', ['latest', False]), ('eth_gasPrice', [])])
+    for result in (block, gas_price):
+        if isinstance(result, RPCError):
+            raise result
+    return HeadSnapshot(
+        number=int(block['number'], 16),
+        timestamp=int(block['timestamp'], 16),
+        gas_price=int(gas_price, 16),
+        fetched_at=time.monotonic()
+    )
+
+def add_head_listener(listener):
+    """Register listener(snapshot) to be called whenever a newer block is seen."""
+    _listeners.append(listener)
+
+def current_head():
+    """Return the cached snapshot without refreshing it; None before the first poll."""
+    return _snapshot
+
+async def _fetch_and_store():
+    global _snapshot
+    snapshot = await run_blocking(fetch_head)
+    new_block = _snapshot is None or snapshot.number > _snapshot.number
+    # A lagging node can answer with an older block; keep the newest head seen
+    if _snapshot is None or snapshot.number >= _snapshot.number:
+        _snapshot = snapshot
+    else:
+        _snapshot = _snapshot._replace(fetched_at=snapshot.fetched_at)
+
+    if new_block:
+        for listener in _listeners:
+            try:
+                listener(_snapshot)
+            except Exception as e:
+                logger.error(f"Error in head listener {listener}: {e}")
+    return _snapshot
+
+async def refresh_head():
+    """Fetch a new snapshot now; callers that arrive while a fetch is running share it."""
+    global _refresh
+    if _refresh is None or _refresh.done():
+        _refresh = asyncio.ensure_future(_fetch_and_store())
+    return await asyncio.shield(_refresh)
+
+async def get_head(max_staleness=HEAD_MAX_STALENESS):
+    """Return the cached head snapshot, refreshing it first if it is older than max_staleness seconds."""
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.age <= max_staleness:
+        return snapshot
+    return await refresh_head()
+
+async def _poll_loop():
+    """Refresh the head snapshot once per block interval."""
+    while True:
+        try:
+            await refresh_head()
+        except Exception as e:
+            logger.error(f"Error polling chain head: {e}")
+        await asyncio.sleep(HEAD_POLL_INTERVAL)
+
+async def start_head_tracker(application=None):
+    """Start the background head poller; usable as an Application post_init hook."""
+    global _poll_task
+    if _poll_task is not None:
+        return
+    _poll_task = asyncio.create_task(_poll_loop())
+    logger.info(f"Head tracker started, polling every {HEAD_POLL_INTERVAL}s.")
+
+async def stop_head_tracker(application=None):
+    """Stop the head poller; usable as an Application post_shutdown hook."""
+    global _poll_task
+    if _poll_task is not None:
+        _poll_task.cancel()
+        _poll_task = None
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+from eth_account import Account
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pre-generated key pairs handed out by /getwallet
+KEY_POOL_SIZE = int(os.getenv('KEY_POOL_SIZE', '32'))
+KEY_POOL_REFILL_BATCH = int(os.getenv('KEY_POOL_REFILL_BATCH', '8'))  # Keys generated per executor job
+
+_pool = None
+_refill_wanted = None
+_refill_task = None
+
+def _generate_accounts(count):
+    """Generate key pairs; CPU-bound, so always run in an executor."""
+    return [Account.create() for _ in range(count)]
+
+async def _refill_loop():
+    """Keep the pool topped up, generating keys off the event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        missing = KEY_POOL_SIZE - _pool.qsize()
+        if missing <= 0:
+            await _refill_wanted.wait()
+            _refill_wanted.clear()
+            continue
+
+        try:
+            accounts = await loop.run_in_executor(None, _generate_accounts, min(missing, KEY_POOL_REFILL_BATCH))
+        except Exception as e:
+            logger.error(f"Error generating wallet keys for the pool: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for account in accounts:
+            _pool.put_nowait(account)
+        logger.debug(f"Key pool refilled to {_pool.qsize()} of {KEY_POOL_SIZE}.")
+
+async def start_key_pool(application=None):
+    """Start the background refill task; usable as an Application post_init hook."""
+    global _pool, _refill_wanted, _refill_task
+    if _refill_task is not None:
+        return
+    _pool = asyncio.Queue()
+    _refill_wanted = asyncio.Event()
+    _refill_task = asyncio.create_task(_refill_loop())
+    logger.info(f"Key pool started with a target size of {KEY_POOL_SIZE}.")
+
+async def stop_key_pool(application=None):
+    """Stop the refill task; usable as an Application post_shutdown hook."""
+    global _refill_task
+    if _refill_task is not None:
+        _refill_task.cancel()
+        _refill_task = None
+
+async def create_wallet():
+    """Return a new account, taken from the pool when possible and otherwise generated in an executor."""
+    if _pool is not None:
+        _refill_wanted.set()
+        try:
+            return _pool.get_nowait()
+        except asyncio.QueueEmpty:
+            logger.debug("Key pool is empty; generating a key on demand.")
+
+    accounts = await asyncio.get_running_loop().run_in_executor(None, _generate_accounts, 1)
+    return accounts[0]
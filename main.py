@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import atexit  # To handle bot shutdown cleanly
+import functools
+import signal
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackContext, CallbackQueryHandler
 from welcome import redpepebot, button_handler  # Import welcome and button handlers
@@ -8,8 +11,19 @@ from tip import tip  # Import tip handler for tokens
 from buy import buy  # Import buy handler for tokens
 from sell import sell  # Import sell handler for tokens
 from convert_tokens import convert  # Token conversion handler
-from utils_token import init_db, display_leaderboard, get_user_wallet, save_bot_data, clean_old_data
+from utils_token import (init_db, display_leaderboard, get_user_wallet, save_wallet_if_absent, clean_old_data, record_activity,
+                         flush_activity_buffer, load_activity_index, warm_wallet_cache, ACTIVITY_FLUSH_INTERVAL,
+                         RETENTION_INTERVAL)
 from rain import rain_command
+from db import close_all
+from chain import web3, run_blocking
+import call_cache
+from tokens import load_tokens, reload_tokens
+from key_pool import create_wallet, start_key_pool, stop_key_pool
+from head import start_head_tracker, stop_head_tracker
+from receipts import start_receipt_watcher, stop_receipt_watcher
+from amm import start_amm, load_pairs
+from prices import start_price_service, stop_price_service
 from dotenv import load_dotenv
 import os
 from wallet import register_wallet_handlers  # Import wallet handlers
@@ -17,6 +31,8 @@ from wallet import register_wallet_handlers  # Import wallet handlers
 # Load environment variables
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+WALLET_CACHE_WARM = os.getenv('WALLET_CACHE_WARM', 'false').lower() == 'true'
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))  # Updates handled at the same time
 
 # Define conversation states
 SHOW_PRIVATE_KEY = range(1)
@@ -49,6 +65,25 @@ async def commands_handler(update: Update, context: CallbackContext):
     )
     await update.message.reply_text(commands_text)
 
+# Wallet-spending commands run one at a time per user, while different users run concurrently
+_user_locks = {}  # user id -> [asyncio.Lock, commands holding or waiting for it]
+
+def one_at_a_time_per_user(handler):
+    """Serialize handler per user so balance checks and sends for one wallet do not interleave."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: CallbackContext):
+        user_id = update.effective_user.id if update.effective_user else None
+        entry = _user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(update, context)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _user_locks[user_id]
+    return wrapper
+
 # /getwallet handler
 async def getwallet(update: Update, context: CallbackContext):
     """Creates or shows a wallet, ensuring it's done in private chat."""
@@ -70,8 +105,17 @@ async def getwallet(update: Update, context: CallbackContext):
         )
         return SHOW_PRIVATE_KEY
     else:
-        new_wallet = Web3().eth.account.create()
-        save_wallet(user_id, new_wallet.address, new_wallet.privateKey.hex())  # Save wallet to database
+        new_wallet = await create_wallet()  # Pre-generated key pair, or generated in an executor
+        wallet, created = await asyncio.get_running_loop().run_in_executor(
+            None, save_wallet_if_absent, user_id, new_wallet.address, new_wallet.key.hex()
+        )  # Save wallet to database unless a concurrent /getwallet already did
+
+        if not created:
+            await update.message.reply_text(
+                f"You already have a wallet.\n"
+                f"Your wallet address: {wallet['address']}"
+            )
+            return ConversationHandler.END
 
         await update.message.reply_text(
             f"New wallet created!\n"
@@ -109,19 +153,89 @@ async def user_activity_and_interaction_handler(update: Update, context: Callbac
         username = update.message.from_user.username or f"User {user_id}"
         is_bot = update.message.from_user.is_bot
 
-        save_bot_data(str(update.message.chat_id), user_id, username, is_bot)
+        if record_activity(update.message.chat_id, user_id, username, is_bot):
+            # The buffer is full: write it out off the event loop
+            asyncio.get_running_loop().run_in_executor(None, flush_activity_buffer)
         logger.info(f"User {username} ({user_id}) is active.")
 
+# Periodically flush buffered user activity to the database off the event loop
+async def flush_activity_job(context: CallbackContext):
+    await asyncio.get_running_loop().run_in_executor(None, flush_activity_buffer)
+
+# Periodically delete expired activity off the event loop
+async def retention_job(context: CallbackContext):
+    removed, elapsed = await asyncio.get_running_loop().run_in_executor(None, clean_old_data)
+    logger.info(f"Retention job removed {removed} rows in {elapsed:.2f}s.")
+
 # Save bot_data on shutdown
 def shutdown_handler():
     logger.info("Shutting down the bot.")
+    flushed = flush_activity_buffer()
+    logger.info(f"Flushed {flushed} buffered activity rows on shutdown.")
+    close_all()
+
+# Reload token configuration on SIGHUP
+def reload_token_config():
+    """Reload the token registry and re-resolve the AMM pairs for it."""
+    reload_tokens()
+    try:
+        load_pairs()
+    except Exception as e:
+        logger.error(f"Error reloading AMM pairs: {e}")
+
+async def reload_token_config_async():
+    """Run the blocking reload in the RPC thread pool so the event loop keeps serving updates."""
+    try:
+        await run_blocking(reload_token_config)
+    except Exception as e:
+        logger.error(f"Error reloading token configuration: {e}")
+
+def install_reload_signal():
+    """Reload the token configuration on SIGHUP through the event loop rather than a raw signal handler."""
+    if not hasattr(signal, 'SIGHUP'):
+        return
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload_token_config_async()))
+    except NotImplementedError:
+        logger.warning("SIGHUP reloads are not supported on this platform.")
+
+# Start background tasks once the event loop is running
+async def post_init(application):
+    install_reload_signal()  # SIGHUP reloads tokens from .env
+    await start_key_pool(application)  # Pre-generate wallet keys in the background
+    await start_head_tracker(application)  # Keep a cached head block and gas price
+    await start_amm(application)  # Quote swaps from pair reserves refreshed every block
+    await start_receipt_watcher(application)  # Confirm broadcast transactions once per block
+    await start_price_service(application)  # Refresh USD prices in the background
+
+async def post_shutdown(application):
+    await stop_price_service(application)
+    await stop_receipt_watcher(application)
+    await stop_head_tracker(application)
+    await stop_key_pool(application)
 
 def main():
     # Initialize the bot
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)  # A slow swap for one user must not hold up everyone else
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    # Initialize the SQLite database
+    # Initialize the SQLite database and seed the in-memory activity index from it
     init_db()
+    load_activity_index()
+    if WALLET_CACHE_WARM:
+        warm_wallet_cache()
+
+    # Serve repeated eth_calls within a block from memory
+    call_cache.install(web3)
+
+    # Load token contracts, checksums and decimals once; SIGHUP reloads them from .env (see post_init)
+    load_tokens()
 
     # Register wallet handlers
     register_wallet_handlers(application)
@@ -130,9 +244,9 @@ def main():
     application.add_handler(CommandHandler('redpepebot', redpepebot))
     application.add_handler(CommandHandler('getwallet', getwallet))
     application.add_handler(CommandHandler('balance', check_balance))
-    application.add_handler(CommandHandler('buy', buy))
-    application.add_handler(CommandHandler('sell', sell))
-    application.add_handler(CommandHandler('tip', tip))
+    application.add_handler(CommandHandler('buy', one_at_a_time_per_user(buy)))
+    application.add_handler(CommandHandler('sell', one_at_a_time_per_user(sell)))
+    application.add_handler(CommandHandler('tip', one_at_a_time_per_user(tip)))
     application.add_handler(CommandHandler('convert', convert))
 
     # Add leaderboard handlers
@@ -140,13 +254,15 @@ def main():
     application.add_handler(CommandHandler('top10token2', lambda u, c: top10_token_command(u, c, 'token_2')))
 
     # Add rain handler
-    application.add_handler(CommandHandler('rain', rain_command))
+    application.add_handler(CommandHandler('rain', one_at_a_time_per_user(rain_command)))
 
     # Add commands overview handler
     application.add_handler(CommandHandler('commands', commands_handler))
 
     # Register user activity tracking
     application.add_handler(MessageHandler(filters.ALL, user_activity_and_interaction_handler))
+    application.job_queue.run_repeating(flush_activity_job, interval=ACTIVITY_FLUSH_INTERVAL, first=ACTIVITY_FLUSH_INTERVAL)
+    application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=60)
 
     # Register CallbackQueryHandlers for button handling
     application.add_handler(CallbackQueryHandler(button_handler))
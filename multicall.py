@@ -0,0 +1,78 @@
+import logging
+import os
+from eth_abi import decode, encode
+from web3 import Web3
+from dotenv import load_dotenv
+from chain import web3
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Multicall3 is deployed at the same address on Avalanche C-Chain and most EVM chains
+MULTICALL3_ADDRESS = Web3.to_checksum_address(os.getenv('MULTICALL3_ADDRESS', '0xcA11bde05977b3631167028862bE2a173976CA11'))
+
+# Only the Multicall3 functions the bot uses
+MULTICALL3_ABI = [
+    {
+        'name': 'aggregate3',
+        'type': 'function',
+        'stateMutability': 'payable',
+        'inputs': [{
+            'name': 'calls',
+            'type': 'tuple[]',
+            'components': [
+                {'name': 'target', 'type': 'address'},
+                {'name': 'allowFailure', 'type': 'bool'},
+                {'name': 'callData', 'type': 'bytes'}
+            ]
+        }],
+        'outputs': [{
+            'name': 'returnData',
+            'type': 'tuple[]',
+            'components': [
+                {'name': 'success', 'type': 'bool'},
+                {'name': 'returnData', 'type': 'bytes'}
+            ]
+        }]
+    },
+    {
+        'name': 'getEthBalance',
+        'type': 'function',
+        'stateMutability': 'view',
+        'inputs': [{'name': 'addr', 'type': 'address'}],
+        'outputs': [{'name': 'balance', 'type': 'uint256'}]
+    }
+]
+
+multicall_contract = web3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+# ERC-20 balanceOf(address) selector
+BALANCE_OF_SELECTOR = bytes.fromhex('70a08231')
+
+def aggregate(calls, block_identifier='latest'):
+    """Execute [(target, calldata)] in a single eth_call and return [(success, return_data)]."""
+    return multicall_contract.functions.aggregate3(
+        [(Web3.to_checksum_address(target), True, calldata) for target, calldata in calls]
+    ).call(block_identifier=block_identifier)
+
+def decode_uint(success, return_data, default=0):
+    """Decode a single uint256 result, falling back to default for failed or empty calls."""
+    if not success or len(return_data) < 32:
+        return default
+    return decode(['uint256'], return_data)[0]
+
+def get_balances(wallet_address, token_addresses):
+    """Return (native_balance, [token_balance, ...]) for a wallet using one eth_call; failed reads are None."""
+    wallet_address = Web3.to_checksum_address(wallet_address)
+    calls = [(MULTICALL3_ADDRESS, bytes.fromhex(multicall_contract.encodeABI(fn_name='getEthBalance', args=[wallet_address])[2:]))]
+    calls += [(token_address, BALANCE_OF_SELECTOR + encode(['address'], [wallet_address])) for token_address in token_addresses]
+
+    results = aggregate(calls)
+    balances = []
+    for (success, return_data), target in zip(results, [MULTICALL3_ADDRESS] + list(token_addresses)):
+        if not success:
+            logger.error(f"Balance call to {target} failed for wallet {wallet_address}.")
+        balances.append(decode_uint(success, return_data, default=None))
+    return balances[0], balances[1:]
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+from dotenv import load_dotenv
+from chain import web3, run_blocking
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cached nonces older than this are re-read from the node, in case the wallet was used elsewhere
+NONCE_CACHE_TTL = float(os.getenv('NONCE_CACHE_TTL', '60'))
+
+_locks = {}  # address -> [asyncio.Lock, reservations holding or waiting for it]; dropped when idle
+_nonces = {}  # address -> (next_nonce, time.monotonic() of the last update)
+_pruned_at = 0.0
+
+def _cached(address):
+    entry = _nonces.get(address)
+    if entry is None or time.monotonic() - entry[1] > NONCE_CACHE_TTL:
+        return None
+    return entry[0]
+
+def _prune():
+    """Drop expired nonces at most once per NONCE_CACHE_TTL, so the cache only holds recently used wallets."""
+    global _pruned_at
+    now = time.monotonic()
+    if now - _pruned_at < NONCE_CACHE_TTL:
+        return
+    _pruned_at = now
+    for address, (nonce, updated_at) in list(_nonces.items()):
+        if now - updated_at > NONCE_CACHE_TTL:
+            del _nonces[address]
+
+def prime_nonce(address, pending):
+    """Seed the cache with a pending transaction count fetched elsewhere, e.g. in a preflight batch."""
+    address = Web3.to_checksum_address(address)
+    cached = _cached(address)
+    _nonces[address] = (pending if cached is None else max(cached, pending), time.monotonic())
+
+async def reserve_nonce(address, count=1):
+    """Reserve count consecutive nonces for address and return the first one.
+
+    Allocation is serialized per wallet, so concurrent commands from the same user get distinct nonces.
+    The node is only asked for the pending count when nothing fresh is cached.
+    """
+    address = Web3.to_checksum_address(address)
+    entry = _locks.setdefault(address, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            nonce = _cached(address)
+            if nonce is None:
+                nonce = await run_blocking(web3.eth.get_transaction_count, address, 'pending')
+            _nonces[address] = (nonce + count, time.monotonic())
+            _prune()
+            return nonce
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _locks[address]
+
+def reset_nonce(address):
+    """Forget the cached nonce after a failed send so the next reservation resyncs with the pending count."""
+    address = Web3.to_checksum_address(address)
+    if _nonces.pop(address, None) is not None:
+        logger.info(f"Nonce cache reset for {address}.")
+
+async def send_transaction(address, build, private_key):
+    """Reserve the next nonce for address, build the transaction with build(nonce), then sign and send it.
+
+    If building fails the reserved nonce was never used, so the cache is reset as for a failed send.
+    """
+    nonce = await reserve_nonce(address)
+    try:
+        transaction = build(nonce)
+    except Exception:
+        reset_nonce(address)
+        raise
+    return await sign_and_send(transaction, private_key)
+
+class BroadcastUnknown(Exception):
+    """A broadcast failed and the node could not be asked whether it has the transaction anyway."""
+
+    def __init__(self, tx_hash, error):
+        super().__init__(f"Broadcast of {tx_hash.hex()} may have succeeded: {error}")
+        self.tx_hash = tx_hash
+
+def _known_to_node(tx_hash):
+    """True if the node has the transaction, pending or mined; raises if the node cannot be asked."""
+    try:
+        return web3.eth.get_transaction(tx_hash) is not None
+    except TransactionNotFound:
+        return False
+
+async def broadcast(raw_transaction, tx_hash):
+    """Send a signed transaction and return its hash.
+
+    A failed send may still have reached the node (e.g. a timeout after the request went out), so the
+    node is asked for the hash before reporting a failure. If that lookup fails too, BroadcastUnknown
+    is raised and the caller must not assume the transaction was dropped.
+    """
+    try:
+        return await run_blocking(web3.eth.send_raw_transaction, raw_transaction)
+    except Exception as e:
+        try:
+            known = await run_blocking(_known_to_node, tx_hash)
+        except Exception:
+            raise BroadcastUnknown(tx_hash, e) from e
+        if not known:
+            raise
+        logger.warning(f"Send of {tx_hash.hex()} failed ({e}) but the node has it; treating it as sent.")
+        return tx_hash
+
+async def sign_and_send(transaction, private_key):
+    """Sign and broadcast a transaction built with a reserved nonce.
+
+    Any failure resets the sender's cached nonce, so the next reservation resyncs with the node
+    whether or not the reserved one was used.
+    """
+    try:
+        signed = web3.eth.account.sign_transaction(transaction, private_key=private_key)
+        return await broadcast(signed.rawTransaction, signed.hash)
+    except Exception:
+        reset_nonce(transaction['from'])
+        raise
@@ -0,0 +1,90 @@
+import logging
+import secrets
+from typing import NamedTuple, Optional
+from eth_abi import encode
+from web3 import Web3
+from chain import batch_request, RPCError
+
+logger = logging.getLogger(__name__)
+
+# ERC-20 selectors
+BALANCE_OF_SELECTOR = '0x70a08231'
+TRANSFER_SELECTOR = '0xa9059cbb'
+
+class PreflightError(Exception):
+    """A preflight read failed or returned no data; the message names the read."""
+
+class RainPreflight(NamedTuple):
+    token_balance: int
+    avax_balance: int
+    nonce: int
+    transfer_gas: Optional[int]  # None if estimation failed
+
+class BuyPreflight(NamedTuple):
+    fee_token_balance: int
+    avax_balance: int
+    nonce: int
+
+def _eth_call(to, data):
+    return ('eth_call', [{'to': Web3.to_checksum_address(to), 'data': data}, 'latest'])
+
+def _address_arg(address):
+    return encode(['address'], [Web3.to_checksum_address(address)]).hex()
+
+def _uint(result, what):
+    """Decode a hex quantity or a uint256 eth_call result, raising PreflightError naming what was read.
+
+    An eth_call to an address without code returns '0x', which is reported instead of decoded.
+    """
+    if isinstance(result, RPCError):
+        raise PreflightError(f"{what} failed: {result}")
+    if not result or result == '0x':
+        raise PreflightError(f"{what} returned no data (is the contract address correct?)")
+    return int(result, 16)
+
+def rain_preflight(token_address, sender_address, amount_each):
+    """Fetch everything /rain needs before signing in one JSON-RPC batch.
+
+    The transfer is estimated for the real per-user amount to a fresh address: writing a balance that
+    goes from zero to non-zero is the most expensive case, so the estimate covers every recipient.
+    """
+    sender_address = Web3.to_checksum_address(sender_address)
+    fresh_address = Web3.to_checksum_address('0x' + secrets.token_hex(20))
+    calls = [
+        _eth_call(token_address, BALANCE_OF_SELECTOR + _address_arg(sender_address)),
+        ('eth_getBalance', [sender_address, 'latest']),
+        ('eth_getTransactionCount', [sender_address, 'pending']),
+        ('eth_estimateGas', [{
+            'from': sender_address,
+            'to': Web3.to_checksum_address(token_address),
+            'data': TRANSFER_SELECTOR + encode(['address', 'uint256'], [fresh_address, amount_each]).hex()
+        }])
+    ]
+    token_balance, avax_balance, nonce, transfer_gas = batch_request(calls)
+
+    if isinstance(transfer_gas, RPCError):
+        logger.error(f"Error estimating transfer gas: {transfer_gas}")
+        transfer_gas = None
+
+    return RainPreflight(
+        token_balance=_uint(token_balance, f"balanceOf on token {token_address}"),
+        avax_balance=_uint(avax_balance, "AVAX balance"),
+        nonce=_uint(nonce, "nonce"),
+        transfer_gas=_uint(transfer_gas, "transfer gas estimate") if transfer_gas is not None else None
+    )
+
+def buy_preflight(fee_token_address, wallet_address):
+    """Fetch the fee-token balance, AVAX balance and nonce in one batch; the token price is quoted by routing."""
+    wallet_address = Web3.to_checksum_address(wallet_address)
+    calls = [
+        _eth_call(fee_token_address, BALANCE_OF_SELECTOR + _address_arg(wallet_address)),
+        ('eth_getBalance', [wallet_address, 'latest']),
+        ('eth_getTransactionCount', [wallet_address, 'pending'])
+    ]
+    fee_token_balance, avax_balance, nonce = batch_request(calls)
+
+    return BuyPreflight(
+        fee_token_balance=_uint(fee_token_balance, f"balanceOf on fee token {fee_token_address}"),
+        avax_balance=_uint(avax_balance, "AVAX balance"),
+        nonce=_uint(nonce, "nonce")
+    )
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+from decimal import Decimal
+import httpx
+from dotenv import load_dotenv
+from web3 import Web3
+from cache import TTLCache
+from chain import run_blocking, WAVAX_ADDRESS
+from head import HEAD_POLL_INTERVAL
+from amm import get_mid_price, QuoteUnavailable
+from routing import best_route
+from tokens import list_tokens
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# CoinGecko simple-price endpoint; every tracked id is fetched in one request per refresh
+COINGECKO_API_URL = os.getenv('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3/simple/price')
+PRICE_REFRESH_INTERVAL = float(os.getenv('PRICE_REFRESH_INTERVAL', '60'))  # Seconds between refreshes
+PRICE_MAX_STALENESS = float(os.getenv('PRICE_MAX_STALENESS', '900'))  # Older prices are no longer served
+PRICE_CACHE_SIZE = int(os.getenv('PRICE_CACHE_SIZE', '256'))  # Prices (and so ids) tracked at most
+PRICE_HTTP_TIMEOUT = float(os.getenv('PRICE_HTTP_TIMEOUT', '10'))  # Seconds per CoinGecko request
+PRICE_BACKOFF_MAX = float(os.getenv('PRICE_BACKOFF_MAX', '600'))  # Longest pause after HTTP 429
+
+# On-chain USD prices, quoted against a stablecoin through the pair graph (see routing.py)
+USD_PRICE_SOURCE = os.getenv('USD_PRICE_SOURCE', 'coingecko').lower()  # 'coingecko' or 'onchain'; the other is the fallback
+USD_STABLECOIN_ADDRESS = Web3.to_checksum_address(os.getenv('USD_STABLECOIN_ADDRESS', '0xB97EF9Ef8734C71904D8002F8b6Bc66Dd9c48a6E'))  # USDC
+USD_STABLECOIN_DECIMALS = int(os.getenv('USD_STABLECOIN_DECIMALS', '6'))
+ONCHAIN_PRICE_REFRESH_INTERVAL = float(os.getenv('ONCHAIN_PRICE_REFRESH_INTERVAL', str(5 * HEAD_POLL_INTERVAL)))  # Seconds
+
+AVAX_COINGECKO_ID = 'avalanche-2'
+
+class RateLimited(Exception):
+    """CoinGecko answered HTTP 429."""
+
+    def __init__(self, retry_after=None):
+        super().__init__(f"Rate limited by CoinGecko (Retry-After: {retry_after})")
+        self.retry_after = retry_after
+
+# Prices stay servable for PRICE_MAX_STALENESS while the refresher keeps replacing them in the background
+_prices = TTLCache(maxsize=PRICE_CACHE_SIZE, ttl=PRICE_MAX_STALENESS)  # CoinGecko id -> USD
+_onchain_prices = TTLCache(maxsize=PRICE_CACHE_SIZE, ttl=PRICE_MAX_STALENESS)  # Token address -> USD
+_extra_ids = set()  # Ids asked for that are not AVAX or a registered token
+_client = None
+_refresh_task = None
+_wake = None
+_backoff = 0.0
+
+def tracked_ids():
+    """AVAX, every registered token with a CoinGecko id, and any other id that has been asked for."""
+    ids = [AVAX_COINGECKO_ID] + [token.coingecko_id for token in list_tokens() if token.coingecko_id]
+    return list(dict.fromkeys(ids + sorted(_extra_ids)))[:PRICE_CACHE_SIZE]
+
+def get_usd_price(coingecko_id):
+    """Return the cached USD price for coingecko_id, or None if it has not been fetched yet.
+
+    Never makes a network call; an unknown id is added to the next background refresh.
+    """
+    if not coingecko_id:
+        return None
+    price = _prices.get(coingecko_id)
+    if price is None and coingecko_id not in _extra_ids and coingecko_id not in tracked_ids():
+        if len(_extra_ids) < PRICE_CACHE_SIZE:
+            _extra_ids.add(coingecko_id)
+            if _wake is not None and not _backoff:
+                _wake.set()
+    return price
+
+def _from_sources(coingecko_id, address):
+    """Cached price from the USD_PRICE_SOURCE source, falling back to the other one."""
+    if USD_PRICE_SOURCE == 'onchain':
+        return _onchain_prices.get(address) or get_usd_price(coingecko_id)
+    return get_usd_price(coingecko_id) or _onchain_prices.get(address)
+
+def get_token_price_in_usd(token):
+    """Cached USD price for a registry token, or None if neither source has one."""
+    return _from_sources(token.coingecko_id, token.address)
+
+def get_avax_price_in_usd() -> Decimal:
+    """Cached AVAX/USD price, or Decimal(0) if none is available."""
+    return _from_sources(AVAX_COINGECKO_ID, WAVAX_ADDRESS) or Decimal(0)
+
+def refresh_onchain_prices():
+    """Value one unit of AVAX and of every registered token in the stablecoin along its best route.
+
+    Prices are the mid price of cached pair reserves when they are fresh, so this usually costs no RPC
+    calls; otherwise the router's quote for one unit is used.
+    Returns the number of prices that could not be quoted.
+    """
+    assets = [(WAVAX_ADDRESS, 18)] + [(token.address, token.decimals) for token in list_tokens()]
+    missing = 0
+    for address, decimals in assets:
+        try:
+            if address == USD_STABLECOIN_ADDRESS:
+                price = Decimal(1)
+            else:
+                path, amounts = best_route(10 ** decimals, address, USD_STABLECOIN_ADDRESS)
+                try:
+                    # Value at the mid price of the pools, without the fees and price impact of a real swap
+                    price = get_mid_price(path) * Decimal(10 ** decimals) / Decimal(10 ** USD_STABLECOIN_DECIMALS)
+                except QuoteUnavailable:
+                    # Reserves are not cached, so the route was priced by the router's getAmountsOut
+                    price = Decimal(amounts[-1]) / Decimal(10 ** USD_STABLECOIN_DECIMALS)
+            _onchain_prices.set(address, price)
+        except Exception as e:
+            logger.debug(f"No on-chain USD price for {address}: {e}")
+            missing += 1
+    return missing
+
+async def refresh_prices():
+    """Fetch every tracked id from CoinGecko in a single request and cache the results."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=PRICE_HTTP_TIMEOUT)
+
+    ids = tracked_ids()
+    response = await _client.get(COINGECKO_API_URL, params={'ids': ','.join(ids), 'vs_currencies': 'usd'})
+    if response.status_code == 429:
+        retry_after = response.headers.get('Retry-After')
+        raise RateLimited(float(retry_after) if retry_after and retry_after.isdigit() else None)
+    response.raise_for_status()
+
+    data = response.json()
+    for coingecko_id in ids:
+        usd = data.get(coingecko_id, {}).get('usd')
+        if usd is not None:
+            _prices.set(coingecko_id, Decimal(str(usd)))
+    logger.debug(f"Refreshed {len(data)} of {len(ids)} CoinGecko prices.")
+
+async def _refresh_loop():
+    """Refresh on-chain prices every ONCHAIN_PRICE_REFRESH_INTERVAL and CoinGecko prices every
+    PRICE_REFRESH_INTERVAL, backing off exponentially while CoinGecko rate limits us.
+
+    With USD_PRICE_SOURCE=onchain, CoinGecko is only asked when some price cannot be quoted on-chain.
+    """
+    global _backoff
+    loop = asyncio.get_running_loop()
+    next_coingecko = 0.0
+    while True:
+        try:
+            missing = await run_blocking(refresh_onchain_prices)
+        except Exception as e:
+            logger.error(f"Error refreshing on-chain USD prices: {e}")
+            missing = 1
+
+        if (USD_PRICE_SOURCE != 'onchain' or missing or _extra_ids) and loop.time() >= next_coingecko:
+            try:
+                await refresh_prices()
+                _backoff = 0.0
+            except RateLimited as e:
+                _backoff = min(max(_backoff * 2, PRICE_REFRESH_INTERVAL, e.retry_after or 0), PRICE_BACKOFF_MAX)
+                logger.warning(f"{e}; next CoinGecko refresh in {PRICE_REFRESH_INTERVAL + _backoff:.0f}s.")
+            except Exception as e:
+                logger.error(f"Error refreshing prices from CoinGecko: {e}")
+            next_coingecko = loop.time() + PRICE_REFRESH_INTERVAL + _backoff
+
+        # Sleep until the next refresh, or until a new CoinGecko id is asked for
+        _wake.clear()
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=min(ONCHAIN_PRICE_REFRESH_INTERVAL, PRICE_REFRESH_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+        if _wake.is_set() and not _backoff:
+            next_coingecko = 0.0
+
+async def start_price_service(application=None):
+    """Start the background price refresher; usable as an Application post_init hook."""
+    global _refresh_task, _wake
+    if _refresh_task is not None:
+        return
+    _wake = asyncio.Event()
+    _refresh_task = asyncio.create_task(_refresh_loop())
+    logger.info(f"Price service started with {USD_PRICE_SOURCE} as the primary USD price source.")
+
+async def stop_price_service(application=None):
+    """Stop the price refresher and close its HTTP client; usable as an Application post_shutdown hook."""
+    global _refresh_task, _client
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,15 +1,17 @@
+import asyncio
 import logging
 import os
 from telegram import Update
 from telegram.ext import CallbackContext
 from web3 import Web3
-from utils_token import get_active_users, get_user_wallet, clean_old_data, update_leaderboard
-
-# Load environment variables
-AVALANCHE_RPC = os.getenv('AVALANCHE_RPC')
-
-# Initialize Web3 instance
-web3 = Web3(Web3.HTTPProvider(AVALANCHE_RPC))
+from chain import web3, run_blocking
+from preflight import rain_preflight, PreflightError
+from head import get_head
+from nonces import prime_nonce, reserve_nonce, reset_nonce, broadcast, BroadcastUnknown
+from receipts import notify_on_receipts
+from disperse import disperse_enabled, disperse_token
+from tokens import get_token
+from utils_token import get_rain_recipients, get_user_wallet, update_leaderboard
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -18,23 +20,121 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# Function to dynamically select the token contract and ABI
-def get_token_contract(token_name):
-    """Returns the appropriate token contract based on the token name."""
-    token_contract_address = os.getenv(f'{token_name.upper()}_TOKEN_CONTRACT_ADDRESS')
-    token_abi = json.loads(os.getenv(f'TOKEN_ABI_{token_name.upper()}', '[]'))
-
-    if token_contract_address and token_abi:
-        return web3.eth.contract(address=Web3.to_checksum_address(token_contract_address), abi=token_abi)
-    else:
-        raise ValueError(f"Unsupported or unknown token: {token_name}")
+RAIN_MAX_LINKS = 5  # Transaction links shown in the rain reply
+RAIN_SEND_CONCURRENCY = int(os.getenv('RAIN_SEND_CONCURRENCY', '10'))  # Individual transfers broadcast at once
+RAIN_GAS_HEADROOM = 1.3  # Margin on the worst-case transfer estimate; unused gas is not charged
+RAIN_FALLBACK_GAS = 65000  # Gas limit for an ERC-20 transfer when estimation fails
+
+def _sign_transfers(token_contract, private_key, sender_address, recipients, amount, gas_limit, gas_price, first_nonce):
+    """Build and sign one transfer per recipient with consecutive nonces; CPU-bound, so run in the executor."""
+    signed_transactions = []
+    for offset, (user_id, username, recipient_address) in enumerate(recipients):
+        tx = token_contract.functions.transfer(Web3.to_checksum_address(recipient_address), amount).build_transaction({
+            'from': sender_address,
+            'gas': gas_limit,
+            'gasPrice': gas_price,
+            'nonce': first_nonce + offset,
+            'chainId': 43114
+        })
+        signed_transactions.append(web3.eth.account.sign_transaction(tx, private_key=private_key))
+    return signed_transactions
+
+async def _fill_nonce(sender_address, private_key, nonce, gas_price):
+    """Use nonce with a 0-AVAX transfer to self so the transactions after it can be mined."""
+    signed = web3.eth.account.sign_transaction({
+        'from': sender_address,
+        'to': sender_address,
+        'value': 0,
+        'gas': 21000,
+        'gasPrice': gas_price,
+        'nonce': nonce,
+        'chainId': 43114
+    }, private_key=private_key)
+    try:
+        tx_hash = await broadcast(signed.rawTransaction, signed.hash)
+    except Exception as e:
+        logger.error(f"Failed to fill nonce {nonce} of {sender_address}: {e}")
+        return False
+    logger.info(f"Filled nonce {nonce} of {sender_address} with {tx_hash.hex()}")
+    return True
+
+async def send_individual_transfers(token_contract, initiator_wallet, recipients, tokens_per_user_in_wei, gas_limit, gas_price):
+    """Pre-sign one ERC-20 transfer per recipient and broadcast them concurrently.
+
+    Every transfer has the same token and amount, so one worst-case gas estimate covers them all. A transfer
+    the node does not have is retried once, and otherwise its nonce is filled with a no-op, since every later
+    transfer waits on it. Returns (outcomes, unconfirmed):
+    - outcomes: [(recipient, tx_hash or None)] in recipient order; None if the transfer was not sent or is unconfirmed.
+    - unconfirmed: recipients whose transfer may still be mined, because its broadcast could not be checked or
+      it waits behind a nonce that could not be used; they must not be paid again.
+    """
+    initiator_address = Web3.to_checksum_address(initiator_wallet['address'])
+    first_nonce = await reserve_nonce(initiator_address, count=len(recipients))
+    try:
+        signed_transactions = await run_blocking(
+            _sign_transfers, token_contract, initiator_wallet['private_key'], initiator_address,
+            recipients, tokens_per_user_in_wei, gas_limit, gas_price, first_nonce
+        )
+    except Exception as e:
+        logger.error(f"Failed to sign rain transactions: {e}")
+        reset_nonce(initiator_address)
+        return [(recipient, None) for recipient in recipients], []
+
+    semaphore = asyncio.Semaphore(RAIN_SEND_CONCURRENCY)
+    ambiguous = set()  # Offsets whose broadcast may or may not have reached the node
+
+    async def send(offset):
+        """Broadcast one transfer and return its hash, or None if it was not sent."""
+        user_id, username, recipient_address = recipients[offset]
+        signed = signed_transactions[offset]
+        async with semaphore:
+            try:
+                tx_hash = await broadcast(signed.rawTransaction, signed.hash)
+            except BroadcastUnknown as e:
+                logger.error(f"Transaction to {username} (Wallet: {recipient_address}) may have been sent: {e}")
+                ambiguous.add(offset)
+                return None
+            except Exception as e:
+                logger.error(f"Failed to send transaction to {username} (Wallet: {recipient_address}). Error: {e}")
+                return None
+        logger.info(f"Sent {tokens_per_user_in_wei} to {username} (Wallet: {recipient_address}). Transaction Hash: {tx_hash.hex()}")
+        return tx_hash
+
+    tx_hashes = await asyncio.gather(*[send(offset) for offset in range(len(recipients))])
+
+    # A nonce the node does not have holds back every transfer after it; retry it in nonce order, then fill it.
+    # Never fill a nonce whose transfer the node may have. If a nonce cannot be settled, the transfers after it
+    # stay queued on the node and are mined once the wallet's next transaction uses it, so they are unconfirmed.
+    blocked_at = None
+    for offset in range(len(recipients)):
+        if tx_hashes[offset] is not None:
+            continue
+        if offset not in ambiguous:
+            tx_hashes[offset] = await send(offset)
+            if tx_hashes[offset] is not None:
+                continue
+        if offset in ambiguous or not await _fill_nonce(initiator_address, initiator_wallet['private_key'], first_nonce + offset, gas_price):
+            blocked_at = offset
+            logger.error(f"Nonce {first_nonce + offset} of {initiator_address} is unsettled; "
+                         f"the transfers sent after it are reported as unconfirmed.")
+            break
+
+    outcomes = []
+    unconfirmed = []
+    for offset, (recipient, tx_hash) in enumerate(zip(recipients, tx_hashes)):
+        if offset in ambiguous or (blocked_at is not None and offset > blocked_at and tx_hash is not None):
+            unconfirmed.append(recipient)
+            tx_hash = None
+        outcomes.append((recipient, tx_hash))
+
+    # Resync with the node after any failure, whether or not the nonce was filled
+    if any(tx_hash is None for recipient, tx_hash in outcomes):
+        reset_nonce(initiator_address)
+    return outcomes, unconfirmed
 
 async def rain_command(update: Update, context: CallbackContext):
     """Handles the /rain command to distribute tokens among active users."""
     try:
-        # Clean up old data in the database before processing
-        clean_old_data()
-
         # Parse command arguments
         args = context.args
         if len(args) < 3:
@@ -54,13 +154,10 @@ async def rain_command(update: Update, context: CallbackContext):
         initiator_id = update.message.from_user.id
         initiator_username = update.message.from_user.username
 
-        # Get active users from the last X hours, excluding bots and users without wallets, in this chat only
-        active_users = get_active_users(chat_id, hours)
+        # Get active users from the last X hours in this chat only, joined with their wallets in one query.
+        # Bots, the initiator and users without wallets are excluded.
+        valid_active_users = get_rain_recipients(chat_id, hours, exclude_user_id=initiator_id)
 
-        # Filter users that have a registered wallet and are not bots
-        valid_active_users = [(user_id, username) for user_id, username in active_users 
-                              if user_id and username and get_user_wallet(user_id) and str(user_id) != str(initiator_id)]
-        
         # Check if there are any users to send the tokens to after filtering
         if not valid_active_users:
             await update.message.reply_text("No users with wallets were active to receive tokens. :(")
@@ -74,105 +171,83 @@ async def rain_command(update: Update, context: CallbackContext):
             await update.message.reply_text("You don't have a registered wallet to send the tokens.")
             return
 
-        # Get the token contract
-        token_contract = get_token_contract(token)
-
-        # Fetch token decimals
-        token_decimals = token_contract.functions.decimals().call()
+        # Get the token contract and decimals from the registry
+        token_info = get_token(token)
+        token_contract = token_info.contract
+        token_decimals = token_info.decimals
 
         # Convert total_amount and tokens_per_user to smallest units (token's decimals)
         total_amount_in_wei = int(total_amount * (10 ** token_decimals))  # Convert to smallest unit
         tokens_per_user_in_wei = total_amount_in_wei // len(valid_active_users)  # Split the total tokens equally
 
-        # Estimate gas fee using a sample transfer
+        # Fetch balances, nonce and a worst-case transfer estimate in one JSON-RPC batch
+        initiator_address = Web3.to_checksum_address(initiator_wallet['address'])
         try:
-            sample_recipient_wallet = Web3.to_checksum_address(get_user_wallet(valid_active_users[0][0])['address'])
-
-            # Build a dummy transaction to estimate gas
-            gas_estimate = token_contract.functions.transfer(
-                sample_recipient_wallet,
-                tokens_per_user_in_wei
-            ).estimate_gas({
-                'from': Web3.to_checksum_address(initiator_wallet['address'])
-            })
-        except Exception as e:
-            logger.error(f"Error estimating gas: {e}. Using fallback gas limit.")
-            gas_estimate = 21000  # Fallback gas limit for simple token transfer
+            preflight = await run_blocking(rain_preflight, token_contract.address, initiator_address, tokens_per_user_in_wei)
+        except PreflightError as e:
+            logger.error(f"Rain preflight failed for {token}: {e}")
+            await update.message.reply_text(f"Could not check balances before the rain: {e}.")
+            return
+        initiator_balance = preflight.token_balance
+        avax_balance = preflight.avax_balance
+        prime_nonce(initiator_address, preflight.nonce)
 
-        # Get the current gas price or fallback to a predefined value
+        # Use the cached head gas price or fallback to a predefined value
         try:
-            gas_price = web3.eth.gas_price
+            gas_price = (await get_head()).gas_price
         except Exception as e:
             logger.error(f"Error fetching gas price: {e}. Using fallback gas price.")
             gas_price = web3.to_wei(30, 'gwei')  # Fallback gas price
 
+        # Use the worst-case transfer estimate or fallback to a predefined gas limit
+        gas_estimate = preflight.transfer_gas
+        if gas_estimate is None:
+            logger.error("Error estimating gas. Using fallback gas limit.")
+            gas_estimate = RAIN_FALLBACK_GAS
+        gas_limit = int(gas_estimate * RAIN_GAS_HEADROOM)
+
         # Check if the initiator has sufficient token balance before proceeding
-        initiator_balance = token_contract.functions.balanceOf(initiator_wallet['address']).call()
         total_transfer_amount = tokens_per_user_in_wei * len(valid_active_users)
 
         if initiator_balance < total_transfer_amount:
             await update.message.reply_text("Insufficient token balance to complete the transaction.")
             return
 
-        # Check if the initiator has sufficient AVAX balance to cover gas fees
-        total_gas_fee = gas_estimate * gas_price * len(valid_active_users)  # Account for multiple transfers
-        avax_balance = web3.eth.get_balance(Web3.to_checksum_address(initiator_wallet['address']))
-
-        if avax_balance < total_gas_fee:
-            await update.message.reply_text("Insufficient AVAX balance to cover gas fees.")
-            return
-
-        logger.debug(f"Gas estimate: {gas_estimate}, Gas price: {gas_price}, Total gas fee: {total_gas_fee}")
-
-        # Perform token transfers
-        nonce = web3.eth.get_transaction_count(Web3.to_checksum_address(initiator_wallet['address']))
         tx_hashes = []
-
-        for user_id, username in valid_active_users:
-            recipient_wallet = get_user_wallet(user_id)
-            if recipient_wallet:
-                try:
-                    gas_estimate = token_contract.functions.transfer(
-                        Web3.to_checksum_address(recipient_wallet['address']),
-                        tokens_per_user_in_wei
-                    ).estimate_gas({
-                        'from': Web3.to_checksum_address(initiator_wallet['address'])
-                    })
-                except Exception as e:
-                    logger.error(f"Error estimating gas for {username} (Wallet: {recipient_wallet['address']}): {e}. Using fallback gas limit.")
-                    gas_estimate = 21000  # Fallback gas limit for simple token transfer
-
-                # Create the token transfer transaction
-                tx = token_contract.functions.transfer(
-                    Web3.to_checksum_address(recipient_wallet['address']),
-                    tokens_per_user_in_wei
-                ).build_transaction({
-                    'from': Web3.to_checksum_address(initiator_wallet['address']),
-                    'gas': gas_estimate,
-                    'gasPrice': gas_price,
-                    'nonce': nonce
-                })
-
-                # Sign the transaction
-                try:
-                    signed_tx = web3.eth.account.sign_transaction(tx, private_key=initiator_wallet['private_key'])
-                except Exception as e:
-                    logger.error(f"Failed to sign the transaction for {username} (Wallet: {recipient_wallet['address']}). Error: {e}")
-                    continue
-
-                raw_tx = signed_tx.rawTransaction
-
-                # Send the signed transaction
-                try:
-                    tx_hash = web3.eth.send_raw_transaction(raw_tx)
-                    tx_hashes.append(tx_hash)
-                    logger.info(f"Sent {tokens_per_user_in_wei} to {username} (Wallet: {recipient_wallet['address']}). Transaction Hash: {tx_hash.hex()}")
-                except Exception as e:
-                    logger.error(f"Failed to send transaction to {username} (Wallet: {recipient_wallet['address']}). Error: {e}")
-                    continue
-
-                # Increment the nonce for the next transaction
-                nonce += 1
+        delivered_users = []
+        remaining_users = valid_active_users
+        unconfirmed_count = 0  # Transfers that may still be mined; never retried
+
+        # Send through the batch-transfer contract when configured: one transaction per batch of recipients
+        if disperse_enabled():
+            disperse_hashes, undelivered, unconfirmed = await disperse_token(
+                token_contract, initiator_address, initiator_wallet['private_key'],
+                [address for user_id, username, address in valid_active_users], tokens_per_user_in_wei, gas_price
+            )
+            tx_hashes.extend(disperse_hashes)
+            undelivered = set(undelivered)
+            unconfirmed = set(unconfirmed)
+            remaining_users = [user for user in valid_active_users if Web3.to_checksum_address(user[2]) in undelivered]
+            delivered_users = [user for user in valid_active_users
+                               if Web3.to_checksum_address(user[2]) not in undelivered | unconfirmed]
+            unconfirmed_count = len(unconfirmed)
+            if remaining_users:
+                logger.info(f"Falling back to individual transfers for {len(remaining_users)} recipients.")
+
+        if remaining_users:
+            # Check if the initiator has sufficient AVAX balance to cover gas fees
+            total_gas_fee = gas_limit * gas_price * len(remaining_users)  # Account for multiple transfers
+            if avax_balance < total_gas_fee:
+                await update.message.reply_text("Insufficient AVAX balance to cover gas fees.")
+                return
+
+            logger.debug(f"Gas limit: {gas_limit}, Gas price: {gas_price}, Total gas fee: {total_gas_fee}")
+            outcomes, unconfirmed = await send_individual_transfers(
+                token_contract, initiator_wallet, remaining_users, tokens_per_user_in_wei, gas_limit, gas_price
+            )
+            unconfirmed_count += len(unconfirmed)
+            tx_hashes.extend(tx_hash for user, tx_hash in outcomes if tx_hash is not None)
+            delivered_users.extend(user for user, tx_hash in outcomes if tx_hash is not None)
 
         # Check if any transactions were made
         if tx_hashes:
@@ -181,16 +256,31 @@ async def rain_command(update: Update, context: CallbackContext):
         else:
             logger.error("Failed to execute rain transaction.")
 
-        # Construct the Snowtrace link for the transaction
-        tx_hash_str = tx_hashes[0].hex() if tx_hashes else "N/A"
-
-        # List of users who received the tokens
-        recipient_usernames = [username for user_id, username in valid_active_users]
-
-        logger.info(f"Users with valid wallets: {recipient_usernames}")
-
+        # Construct Snowtrace links, one per transaction up to RAIN_MAX_LINKS
+        shown_hashes = [tx_hash.hex() for tx_hash in tx_hashes[:RAIN_MAX_LINKS]] or ["N/A"]
+        snowtrace_links = ", ".join(
+            f"<a href='https://snowtrace.io/tx/0x{tx_hash_str}'>snowtrace link{f' {i+1}' if len(shown_hashes) > 1 else ''}</a>"
+            for i, tx_hash_str in enumerate(shown_hashes)
+        )
+        if len(tx_hashes) > RAIN_MAX_LINKS:
+            snowtrace_links += f" and {len(tx_hashes) - RAIN_MAX_LINKS} more"
+
+        # List of users whose transfer was sent
+        recipient_usernames = [username for user_id, username, address in delivered_users]
+        failed_count = len(valid_active_users) - len(delivered_users) - unconfirmed_count
+
+        logger.info(f"Rain sent to: {recipient_usernames}; failed for {failed_count} users.")
+
+        if not recipient_usernames and unconfirmed_count:
+            # Some transfers may still be mined, so asking for a retry could pay those users twice
+            await update.message.reply_text(
+                f"{unconfirmed_count} rain transfer(s) were sent but could not be confirmed yet"
+                f"{f', and {failed_count} could not be sent' if failed_count else ''}. "
+                "Check your wallet before raining again."
+            )
+            return
         if not recipient_usernames:
-            await update.message.reply_text(f"No users with valid wallets to receive the tokens.")
+            await update.message.reply_text("The rain transactions could not be sent. Please try again later.")
             return
 
         # Update the leaderboard for the initiator
@@ -207,11 +297,16 @@ async def rain_command(update: Update, context: CallbackContext):
         message = (
             f"The following users split the {total_amount} {token} who were active in the last {hours} hours in this chat:\n"
             f"{recipients}\n\n"
-            f"<a href='https://snowtrace.io/tx/0x{tx_hash_str}'>snowtrace link</a>"
+            f"{snowtrace_links}"
         )
+        if failed_count:
+            message += f"\n{failed_count} transfer(s) could not be sent."
+        if unconfirmed_count:
+            message += f"\n{unconfirmed_count} transfer(s) were sent but not yet confirmed."
 
         # Send the message with HTML parsing enabled so that "snowtrace link" is clickable
-        await update.message.reply_text(message, parse_mode='HTML')
+        reply = await update.message.reply_text(message, parse_mode='HTML')
+        await notify_on_receipts(reply, tx_hashes, "Rain")
 
     except Exception as e:
         logger.error(f"Error in /rain command: {e}")
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from typing import NamedTuple
+from dotenv import load_dotenv
+from chain import batch_request, run_blocking, RPCError
+from head import get_head, HEAD_POLL_INTERVAL
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Receipt polling; all pending transactions are checked together once per new block
+RECEIPT_TIMEOUT = int(os.getenv('RECEIPT_TIMEOUT', '180'))  # Seconds before a transaction is reported as still pending
+RECEIPT_BATCH_SIZE = int(os.getenv('RECEIPT_BATCH_SIZE', '100'))  # Receipts per JSON-RPC batch
+
+class Receipt(NamedTuple):
+    tx_hash: str
+    status: int  # 1 for success, 0 for reverted
+    block_number: int
+    gas_used: int
+
+class _Watch(NamedTuple):
+    future: asyncio.Future
+    deadline: float
+
+_pending = {}  # tx hash (0x-prefixed hex) -> _Watch
+_wake = None
+_watch_task = None
+_notify_tasks = set()  # Keeps notification tasks referenced until they finish
+
+def _hex(tx_hash):
+    tx_hash = tx_hash if isinstance(tx_hash, str) else tx_hash.hex()
+    return tx_hash if tx_hash.startswith('0x') else '0x' + tx_hash
+
+def fetch_receipts(tx_hashes):
+    """Fetch receipts for many transactions in JSON-RPC batches; pending or failed lookups map to None."""
+    receipts = {}
+    for start in range(0, len(tx_hashes), RECEIPT_BATCH_SIZE):
+        chunk = tx_hashes[start:start + RECEIPT_BATCH_SIZE]
+        results = batch_request([('eth_getTransactionReceipt', [tx_hash]) for tx_hash in chunk])
+        for tx_hash, result in zip(chunk, results):
+            if isinstance(result, RPCError) or not result:
+                receipts[tx_hash] = None
+            else:
+                receipts[tx_hash] = Receipt(
+                    tx_hash=tx_hash,
+                    status=int(result['status'], 16),
+                    block_number=int(result['blockNumber'], 16),
+                    gas_used=int(result['gasUsed'], 16)
+                )
+    return receipts
+
+async def _watch_loop():
+    """Poll every pending transaction once per new block and resolve the ones that landed or timed out."""
+    loop = asyncio.get_running_loop()
+    last_block = None
+    while True:
+        if not _pending:
+            await _wake.wait()
+            _wake.clear()
+            continue
+
+        try:
+            head = await get_head(max_staleness=HEAD_POLL_INTERVAL)
+            if head.number != last_block:
+                last_block = head.number
+                receipts = await run_blocking(fetch_receipts, list(_pending))
+                for tx_hash, receipt in receipts.items():
+                    if receipt is not None:
+                        watch = _pending.pop(tx_hash, None)
+                        if watch is not None and not watch.future.done():
+                            watch.future.set_result(receipt)
+        except Exception as e:
+            logger.error(f"Error polling transaction receipts: {e}")
+
+        # Transactions that never landed resolve to None
+        now = loop.time()
+        for tx_hash, watch in list(_pending.items()):
+            if now >= watch.deadline:
+                del _pending[tx_hash]
+                logger.warning(f"Transaction {tx_hash} was not mined before its deadline.")
+                if not watch.future.done():
+                    watch.future.set_result(None)
+
+        await asyncio.sleep(HEAD_POLL_INTERVAL)
+
+async def start_receipt_watcher(application=None):
+    """Start the background receipt poller; usable as an Application post_init hook."""
+    global _wake, _watch_task
+    if _watch_task is not None:
+        return
+    _wake = asyncio.Event()
+    _watch_task = asyncio.create_task(_watch_loop())
+    logger.info("Receipt watcher started.")
+
+async def stop_receipt_watcher(application=None):
+    """Stop the receipt poller; usable as an Application post_shutdown hook."""
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        _watch_task = None
+
+async def watch_transaction(tx_hash, timeout=None):
+    """Register a broadcast transaction and return a future that resolves to its Receipt, or None on timeout."""
+    await start_receipt_watcher()
+    loop = asyncio.get_running_loop()
+    tx_hash = _hex(tx_hash)
+    watch = _pending.get(tx_hash)
+    if watch is None:
+        watch = _Watch(future=loop.create_future(), deadline=loop.time() + (timeout or RECEIPT_TIMEOUT))
+        _pending[tx_hash] = watch
+        _wake.set()
+    return watch.future
+
+async def _notify(message, futures, description):
+    receipts = await asyncio.gather(*futures)
+    confirmed = [receipt for receipt in receipts if receipt is not None and receipt.status == 1]
+    reverted = [receipt for receipt in receipts if receipt is not None and receipt.status != 1]
+    pending = len(receipts) - len(confirmed) - len(reverted)
+
+    if len(receipts) == 1:
+        if confirmed:
+            text = f"{description} was confirmed in block {confirmed[0].block_number}."
+        elif reverted:
+            text = f"{description} failed: the transaction was reverted."
+        else:
+            text = f"{description} is still pending after {RECEIPT_TIMEOUT // 60} minutes. Check Snowtrace for its status."
+    else:
+        text = f"{description}: {len(confirmed)} of {len(receipts)} transactions confirmed"
+        if reverted:
+            text += f", {len(reverted)} reverted"
+        if pending:
+            text += f", {pending} still pending"
+        text += "."
+
+    try:
+        await message.reply_text(text)
+    except Exception as e:
+        logger.error(f"Error sending confirmation for {description}: {e}")
+
+async def notify_on_receipts(message, tx_hashes, description):
+    """Reply to message once every transaction in tx_hashes is mined, reverted or timed out.
+
+    Returns immediately; the confirmation is sent from a background task.
+    """
+    futures = [await watch_transaction(tx_hash) for tx_hash in tx_hashes]
+    if not futures:
+        return
+    task = asyncio.create_task(_notify(message, futures, description))
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
@@ -0,0 +1,93 @@
+import logging
+import os
+from eth_abi import decode, encode
+from web3 import Web3
+from dotenv import load_dotenv
+from chain import router_contract, WAVAX_ADDRESS
+from multicall import aggregate
+import amm
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ROUTE_MAX_HOPS = int(os.getenv('ROUTE_MAX_HOPS', '3'))  # Longest path considered, in swaps
+
+GET_AMOUNTS_OUT_SELECTOR = bytes.fromhex('d06ca61f')  # getAmountsOut(uint256,address[])
+
+class NoRoute(Exception):
+    """No candidate path between two tokens returned a quote."""
+
+_graph = {}  # token address -> set of token addresses it shares a pair with
+_graph_pairs = None  # amm pair list the graph was built from
+
+def pair_graph():
+    """Adjacency sets built from the pairs the AMM engine tracks; rebuilt whenever those pairs are reloaded."""
+    global _graph, _graph_pairs
+    pairs = amm.tracked_pairs()
+    if pairs != _graph_pairs:
+        graph = {}
+        for pair in pairs:
+            graph.setdefault(pair.token0, set()).add(pair.token1)
+            graph.setdefault(pair.token1, set()).add(pair.token0)
+        _graph, _graph_pairs = graph, pairs
+        logger.info(f"Routing graph has {len(graph)} tokens and {len(pairs)} pairs.")
+    return _graph
+
+def find_paths(token_in, token_out, max_hops=None):
+    """Every simple path from token_in to token_out with at most max_hops swaps, shortest first."""
+    token_in, token_out = Web3.to_checksum_address(token_in), Web3.to_checksum_address(token_out)
+    max_hops = max_hops or ROUTE_MAX_HOPS
+    graph = pair_graph()
+
+    paths = []
+    stack = [[token_in]]
+    while stack:
+        path = stack.pop()
+        for neighbour in graph.get(path[-1], ()):
+            if neighbour == token_out:
+                paths.append(path + [neighbour])
+            elif neighbour not in path and len(path) < max_hops:
+                stack.append(path + [neighbour])
+
+    if not paths:
+        # Graph not loaded yet: fall back to the direct pair and the hop through WAVAX
+        paths = [[token_in, token_out]]
+        if WAVAX_ADDRESS not in (token_in, token_out):
+            paths.append([token_in, WAVAX_ADDRESS, token_out])
+    return sorted(paths, key=len)
+
+def _local_quote(amount_in, path):
+    try:
+        return amm.get_amounts_out(amount_in, path)
+    except amm.QuoteUnavailable:
+        return None
+
+def _router_quotes(amount_in, paths):
+    """getAmountsOut for every path in one Multicall3 call; paths the router cannot quote map to None."""
+    calls = [(router_contract.address, GET_AMOUNTS_OUT_SELECTOR + encode(['uint256', 'address[]'], [amount_in, path]))
+             for path in paths]
+    return [decode(['uint256[]'], data)[0] if success and len(data) >= 64 else None
+            for success, data in aggregate(calls)]
+
+def best_route(amount_in, token_in, token_out, max_hops=None, fresh=False):
+    """Return (path, amounts) for the path that yields the most token_out for amount_in.
+
+    Candidates are priced from the AMM engine's cached reserves. If none of them can be quoted locally
+    (stale reserves, graph not loaded), all candidates are priced by the router in a single multicall instead.
+    With fresh=True the cache is skipped and the router always prices them at the latest block; use it when
+    the amounts become an on-chain limit, such as a swap's minimum output.
+    """
+    amount_in = int(amount_in)
+    paths = find_paths(token_in, token_out, max_hops)
+    quotes = [None] * len(paths) if fresh else [_local_quote(amount_in, path) for path in paths]
+    if not any(quotes):
+        logger.debug(f"No local quotes; pricing {len(paths)} paths with the router.")
+        quotes = _router_quotes(amount_in, paths)
+
+    candidates = [(path, list(amounts)) for path, amounts in zip(paths, quotes) if amounts]
+    if not candidates:
+        raise NoRoute(f"No route from {token_in} to {token_out}")
+    # Ties go to the shorter path, which costs less gas
+    return max(candidates, key=lambda candidate: (candidate[1][-1], -len(candidate[0])))
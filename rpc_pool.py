@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from eth_utils import keccak
+from hexbytes import HexBytes
+from urllib3.exceptions import NewConnectionError
+from web3.providers.base import JSONBaseProvider
+
+logger = logging.getLogger(__name__)
+
+# Read-only methods that may be sent to a second node when the first is slow
+HEDGED_METHODS = {
+    'eth_call', 'eth_getBalance', 'eth_blockNumber', 'eth_getBlockByNumber', 'eth_gasPrice', 'eth_chainId',
+    'eth_getTransactionCount', 'eth_estimateGas', 'eth_getTransactionReceipt', 'eth_getTransactionByHash', 'eth_getCode',
+    'net_version', 'web3_clientVersion'
+}
+
+# Methods that must not be repeated on another node after an ambiguous failure, such as a read timeout
+WRITE_METHODS = {'eth_sendRawTransaction', 'eth_sendTransaction'}
+
+# Errors a node gives for a raw transaction it may already have, e.g. when it is resent after a timeout
+ALREADY_SENT_ERRORS = ('already known', 'nonce too low')
+
+EWMA_ALPHA = 0.2  # Weight of the newest sample in the rolling latency and error scores
+LATENCY_WINDOW = 100  # Samples kept per endpoint for the p95 hedge delay
+
+class RPCUnavailable(ConnectionError):
+    """Every RPC endpoint failed for a request."""
+
+def _never_received(error):
+    """True if a failed POST certainly never reached the node: no connection was made, or it answered 429."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code == 429
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.latency = None  # EWMA of successful request latency, in seconds
+        self.error_rate = 0.0  # EWMA of transport failures (timeouts, connection errors, 429 and 5xx)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def score(self):
+        """Lower is better; unmeasured endpoints are tried before slow ones, failing ones after healthy ones."""
+        return (self.latency or 0.0) * (1 + 10 * self.error_rate) + self.error_rate
+
+    def p95(self):
+        if len(self.latencies) < 10:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+class RPCPool:
+    """Send JSON-RPC payloads to the healthiest of several endpoints.
+
+    Endpoints are ranked by latency and error rate. An endpoint that fails eject_after times in a row is
+    skipped for eject_seconds and then readmitted. Read-only payloads are hedged: if the best endpoint has
+    not answered within its p95 latency, the same payload goes to the next best and the first answer wins.
+    """
+
+    def __init__(self, urls, session, timeout, eject_after=3, eject_seconds=30, hedge_delay=0.25, hedge_workers=8):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.session = session
+        self.timeout = timeout
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.hedge_delay = hedge_delay  # Used until an endpoint has enough samples for a p95
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='rpc-hedge')
+
+    def ranked(self):
+        """Healthy endpoints, best first; if every endpoint is ejected, all of them in score order."""
+        now = time.monotonic()
+        with self._lock:
+            ordered = sorted(self.endpoints, key=Endpoint.score)
+            healthy = [endpoint for endpoint in ordered if endpoint.ejected_until <= now]
+        return healthy or ordered
+
+    def _record(self, endpoint, latency, ok):
+        with self._lock:
+            endpoint.error_rate = (1 - EWMA_ALPHA) * endpoint.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+            if ok:
+                endpoint.latency = latency if endpoint.latency is None else (1 - EWMA_ALPHA) * endpoint.latency + EWMA_ALPHA * latency
+                endpoint.latencies.append(latency)
+                if endpoint.ejected_until:
+                    logger.info(f"RPC endpoint {endpoint.url} readmitted.")
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+            else:
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.eject_after:
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                    logger.warning(f"RPC endpoint {endpoint.url} ejected for {self.eject_seconds}s after "
+                                   f"{endpoint.consecutive_failures} consecutive failures.")
+
+    def _post_to(self, endpoint, data):
+        """POST to one endpoint and return the raw body; transport failures raise and count against it."""
+        start = time.monotonic()
+        try:
+            response = self.session.post(endpoint.url, data=data, headers={'Content-Type': 'application/json'},
+                                         timeout=self.timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise requests.HTTPError(f"{response.status_code} from {endpoint.url}", response=response)
+            response.raise_for_status()
+        except Exception:
+            self._record(endpoint, time.monotonic() - start, ok=False)
+            raise
+        self._record(endpoint, time.monotonic() - start, ok=True)
+        return response.content
+
+    def post(self, data, hedge=False, failover=True):
+        """Send a JSON-RPC payload (bytes) and return the raw response body, failing over between endpoints.
+
+        With failover=False, for payloads that must not run twice, the next endpoint is only tried when the
+        previous one certainly never received the payload; any other failure is raised as is.
+        """
+        endpoints = self.ranked()
+        if hedge and len(endpoints) > 1:
+            return self._post_hedged(endpoints, data)
+
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                return self._post_to(endpoint, data)
+            except Exception as e:
+                logger.debug(f"RPC request to {endpoint.url} failed: {e}")
+                last_error = e
+                if not failover and not _never_received(e):
+                    raise
+        raise RPCUnavailable(f"All RPC endpoints failed: {last_error}")
+
+    def _post_hedged(self, endpoints, data):
+        primary, backups = endpoints[0], list(endpoints[1:])
+        futures = {self._hedge_executor.submit(self._post_to, primary, data)}
+        done, _ = wait(futures, timeout=primary.p95() or self.hedge_delay)
+
+        last_error = None
+        while True:
+            for future in done:
+                futures.discard(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+            # Slow or failed so far: bring in the next endpoint, then take whichever answers first
+            if backups:
+                futures.add(self._hedge_executor.submit(self._post_to, backups.pop(0), data))
+            if not futures:
+                raise RPCUnavailable(f"All RPC endpoints failed: {last_error}")
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+    def status(self):
+        """[(url, ewma latency, error rate, ejected)] for logging."""
+        now = time.monotonic()
+        with self._lock:
+            return [(endpoint.url, endpoint.latency, endpoint.error_rate, endpoint.ejected_until > now) for endpoint in self.endpoints]
+
+class PooledProvider(JSONBaseProvider):
+    """Web3 provider that sends every request through an RPCPool."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        raw_response = self.pool.post(request_data, hedge=method in HEDGED_METHODS, failover=method not in WRITE_METHODS)
+        response = self.decode_rpc_response(raw_response)
+        if method == 'eth_sendRawTransaction' and 'error' in response:
+            return self._resolve_resend(params[0], response)
+        return response
+
+    def _resolve_resend(self, raw_transaction, response):
+        """Answer with the transaction hash instead of the error if the node already has this exact transaction."""
+        error = response['error']
+        message = str(error.get('message', '') if isinstance(error, dict) else error).lower()
+        if not any(text in message for text in ALREADY_SENT_ERRORS):
+            return response
+        tx_hash = '0x' + keccak(HexBytes(raw_transaction)).hex()
+        lookup = self.decode_rpc_response(self.pool.post(self.encode_rpc_request('eth_getTransactionByHash', [tx_hash]), hedge=True))
+        if not lookup.get('result'):
+            return response
+        logger.info(f"Node answered '{message}' for {tx_hash}, which it already has; treating it as sent.")
+        return {'jsonrpc': '2.0', 'id': response.get('id'), 'result': tx_hash}
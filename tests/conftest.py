@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_evm import LocalEVM
+
+# The bot's modules connect at import time, so the local chain is up before any of them is imported
+local_evm = LocalEVM()
+os.environ['AVALANCHE_RPC'] = local_evm.serve()
+os.environ.setdefault('TOKENS', '')
+os.environ['HEAD_POLL_INTERVAL'] = '0.05'
+os.environ['RPC_TIMEOUT'] = '2'
+
+from eth_account.datastructures import SignedTransaction
+
+# Newer eth-account releases renamed rawTransaction; the bot is written against the older name
+if not hasattr(SignedTransaction, 'rawTransaction'):
+    SignedTransaction.rawTransaction = property(lambda signed: signed.raw_transaction)
+
+@pytest.fixture
+def evm():
+    """The local chain, rolled back after the test along with the bot's per-process chain state."""
+    import head
+    import nonces
+    import receipts
+
+    snapshot_id = local_evm.snapshot()
+    yield local_evm
+    local_evm.revert(snapshot_id)
+    nonces._nonces.clear()
+    receipts._pending.clear()
+    receipts._watch_task = None
+    head._snapshot = None
+    head._refresh = None
+
+@pytest.fixture
+def reserves(monkeypatch):
+    """Install pairs with the given reserves as fresh, keyed by (token_a, token_b) -> (reserve_a, reserve_b)."""
+    import amm
+    from web3 import Web3
+
+    def install(table):
+        pairs, pair_reserves = {}, {}
+        for index, ((token_a, token_b), (reserve_a, reserve_b)) in enumerate(table.items()):
+            token0, token1 = sorted([Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)], key=str.lower)
+            pair = amm.Pair(address=f'pair{index}', token0=token0, token1=token1)
+            pairs[amm._pair_key(token_a, token_b)] = pair
+            pair_reserves[pair.address] = (reserve_a, reserve_b) if token0.lower() == token_a.lower() else (reserve_b, reserve_a)
+        monkeypatch.setattr(amm, '_pairs', pairs)
+        monkeypatch.setattr(amm, '_reserves', pair_reserves)
+        monkeypatch.setattr(amm, '_reserves_at', time.monotonic())
+    return install
@@ -0,0 +1,217 @@
+"""A local EVM (eth-tester + py-evm) served over HTTP JSON-RPC, with two tiny hand-assembled contracts.
+
+The bot's modules talk to it exactly as they would to an Avalanche node. Transactions are mined as soon
+as they are sent; like a node's mempool, one with a nonce ahead of its sender's is held until the gap is
+filled. `intercept` lets a test fault individual requests.
+"""
+import json
+from collections.abc import Mapping
+import threading
+import rlp
+from eth_account import Account
+from eth_utils import keccak
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_tester import EthereumTester, PyEVMBackend
+from web3 import Web3, EthereumTesterProvider
+
+CHAIN_ID = 43114  # The bot signs every transaction for the C-Chain
+SENDER_KEY = '0x' + '00' * 31 + '01'  # Prefunded eth-tester account
+TOKEN_SUPPLY = 10 ** 30
+
+# Opcodes used by the contracts below
+OPCODES = {
+    'STOP': 0x00, 'ADD': 0x01, 'MUL': 0x02, 'SUB': 0x03, 'LT': 0x10, 'EQ': 0x14, 'ISZERO': 0x15,
+    'NOT': 0x19, 'SHL': 0x1b, 'SHR': 0x1c, 'CALLER': 0x33, 'CALLDATALOAD': 0x35, 'CODECOPY': 0x39,
+    'POP': 0x50, 'MSTORE': 0x52, 'SLOAD': 0x54, 'SSTORE': 0x55, 'JUMP': 0x56, 'JUMPI': 0x57,
+    'GAS': 0x5a, 'JUMPDEST': 0x5b, 'CALL': 0xf1, 'RETURN': 0xf3, 'REVERT': 0xfd,
+    **{f'DUP{n}': 0x7f + n for n in range(1, 17)},
+    **{f'SWAP{n}': 0x8f + n for n in range(1, 17)},
+}
+
+def assemble(program):
+    """Assemble opcode names, ints (pushed with the smallest PUSH), ':label' and '@label' (pushed as PUSH2)."""
+    def encode(labels):
+        code = bytearray()
+        for item in program:
+            if isinstance(item, int):
+                data = item.to_bytes(max(1, (item.bit_length() + 7) // 8), 'big')
+                code += bytes([0x5f + len(data)]) + data
+            elif item.startswith(':'):
+                labels[item[1:]] = len(code)
+                code.append(OPCODES['JUMPDEST'])
+            elif item.startswith('@'):
+                code += bytes([0x61]) + labels.get(item[1:], 0).to_bytes(2, 'big')
+            else:
+                code.append(OPCODES[item])
+        return bytes(code)
+
+    labels = {}
+    encode(labels)  # First pass only places the labels
+    return encode(labels)
+
+def deployer(runtime, constructor=()):
+    """Init code that runs constructor and returns runtime."""
+    offset = 0
+    while True:
+        init = assemble(list(constructor) + [len(runtime), offset, 0, 'CODECOPY', len(runtime), 0, 'RETURN'])
+        if len(init) == offset:
+            return init + runtime
+        offset = len(init)
+
+def _dispatch(selectors):
+    program = [0, 'CALLDATALOAD', 0xe0, 'SHR']
+    for selector, label in selectors:
+        program += ['DUP1', selector, 'EQ', '@' + label, 'JUMPI']
+    return program + [0, 'DUP1', 'REVERT']
+
+# ERC-20 with balances stored at slot = holder and unlimited allowances; the deployer gets TOKEN_SUPPLY
+TOKEN_RUNTIME = assemble(_dispatch([
+    (0x70a08231, 'balanceOf'), (0xa9059cbb, 'transfer'), (0x23b872dd, 'transferFrom'),
+    (0xdd62ed3e, 'allowance'), (0x095ea7b3, 'approve'), (0x313ce567, 'decimals'),
+]) + [
+    ':balanceOf', 4, 'CALLDATALOAD', 'SLOAD', '@ret', 'JUMP',
+    ':transfer', 36, 'CALLDATALOAD', 4, 'CALLDATALOAD', 'CALLER', '@move', 'JUMP',
+    ':transferFrom', 68, 'CALLDATALOAD', 36, 'CALLDATALOAD', 4, 'CALLDATALOAD', '@move', 'JUMP',
+    ':allowance', 0, 'NOT', '@ret', 'JUMP',
+    ':approve', 1, '@ret', 'JUMP',
+    ':decimals', 18, '@ret', 'JUMP',
+    # Stack: from, to, amount
+    ':move', 'DUP1', 'SLOAD', 'DUP4', 'DUP2', 'LT', '@fail', 'JUMPI',
+    'DUP4', 'SWAP1', 'SUB', 'SWAP1', 'SSTORE',
+    'DUP1', 'SLOAD', 'DUP3', 'ADD', 'SWAP1', 'SSTORE', 'POP', 1, '@ret', 'JUMP',
+    ':ret', 0, 'MSTORE', 32, 0, 'RETURN',
+    ':fail', 0, 'DUP1', 'REVERT',
+])
+TOKEN_INIT = deployer(TOKEN_RUNTIME, [TOKEN_SUPPLY, 'CALLER', 'SSTORE'])
+
+# disperseToken(token, recipients, values): transferFrom(caller, recipients[i], values[i]) for each i
+DISPERSE_RUNTIME = assemble(_dispatch([(0xc73a2d60, 'disperseToken')]) + [
+    ':disperseToken', 4, 'CALLDATALOAD', 36, 'CALLDATALOAD', 4, 'ADD', 68, 'CALLDATALOAD', 4, 'ADD',
+    'DUP2', 'CALLDATALOAD', 0,
+    # Stack: i, n, values, recipients, token
+    ':loop', 'DUP2', 'DUP2', 'LT', 'ISZERO', '@done', 'JUMPI',
+    0x23b872dd, 0xe0, 'SHL', 0, 'MSTORE', 'CALLER', 4, 'MSTORE',
+    'DUP1', 32, 'MUL', 'DUP5', 'ADD', 32, 'ADD', 'CALLDATALOAD', 36, 'MSTORE',
+    'DUP1', 32, 'MUL', 'DUP4', 'ADD', 32, 'ADD', 'CALLDATALOAD', 68, 'MSTORE',
+    32, 0, 100, 0, 0, 'DUP10', 'GAS', 'CALL', 'ISZERO', '@fail', 'JUMPI',
+    1, 'ADD', '@loop', 'JUMP',
+    ':done', 'STOP',
+    ':fail', 0, 'DUP1', 'REVERT',
+])
+DISPERSE_INIT = deployer(DISPERSE_RUNTIME)
+
+def _to_json(value):
+    """eth-tester answers with ints and bytes; JSON-RPC wants 0x-prefixed hex."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return hex(value)
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    if isinstance(value, Mapping):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    return value
+
+class LocalEVM:
+    def __init__(self):
+        backend = PyEVMBackend()
+        backend.chain.chain_id = CHAIN_ID
+        self.tester = EthereumTester(backend)
+        self.w3 = Web3(EthereumTesterProvider(self.tester))
+        self.sender = self.w3.eth.account.from_key(SENDER_KEY)
+        self.intercept = None  # intercept(method, params, forward) -> JSON-RPC reply dict
+        self.requests = []  # Methods received, in order
+        self._lock = threading.Lock()
+        self._server = None
+        self._queued = {}  # tx hash -> (sender, nonce, raw transaction) waiting for a nonce gap to be filled
+        self.token = self.deploy(TOKEN_INIT)
+        self.disperse = self.deploy(DISPERSE_INIT)
+
+    def deploy(self, init_code):
+        tx_hash = self.w3.eth.send_transaction({'from': self.sender.address, 'data': init_code, 'gas': 1_000_000})
+        return self.w3.eth.get_transaction_receipt(tx_hash)['contractAddress']
+
+    def balance_of(self, token, holder):
+        data = '0x70a08231' + Web3.to_checksum_address(holder)[2:].lower().rjust(64, '0')
+        return int.from_bytes(self.w3.eth.call({'to': token, 'data': data}), 'big')
+
+    def forward(self, method, params):
+        if method == 'eth_chainId':
+            return {'result': hex(CHAIN_ID)}
+        if method == 'eth_sendRawTransaction':
+            return self._send_raw_transaction(params[0])
+        if method == 'eth_getTransactionByHash' and params[0] in self._queued:
+            sender, nonce, raw_tx = self._queued[params[0]]
+            return {'result': {'hash': params[0], 'from': sender, 'nonce': hex(nonce), 'blockNumber': None}}
+        return self._forward(method, params)
+
+    def _send_raw_transaction(self, raw_tx):
+        raw = bytes.fromhex(raw_tx[2:])
+        sender = Account.recover_transaction(raw)
+        nonce = int.from_bytes(rlp.decode(raw)[0], 'big')
+        with self._lock:
+            next_nonce = self.tester.get_nonce(sender)
+        if nonce > next_nonce:
+            tx_hash = '0x' + keccak(raw).hex()
+            self._queued[tx_hash] = (sender, nonce, raw_tx)
+            return {'result': tx_hash}
+
+        reply = self._forward('eth_sendRawTransaction', [raw_tx])
+        # Mine whatever this transaction was holding back
+        released = reply
+        while 'result' in released:
+            nonce += 1
+            waiting = [tx_hash for tx_hash, queued in self._queued.items() if queued[:2] == (sender, nonce)]
+            if not waiting:
+                break
+            released = self._forward('eth_sendRawTransaction', [self._queued.pop(waiting[0])[2]])
+        return reply
+
+    def _forward(self, method, params):
+        try:
+            with self._lock:
+                response = self.w3.manager._make_request(method, params)
+        except Exception as e:
+            return {'error': {'code': -32000, 'message': str(e)}}
+        return _to_json(dict(response))
+
+    def handle(self, request):
+        self.requests.append(request['method'])
+        if self.intercept is not None:
+            reply = self.intercept(request['method'], request['params'], self.forward)
+        else:
+            reply = self.forward(request['method'], request['params'])
+        return {**reply, 'jsonrpc': '2.0', 'id': request['id']}
+
+    def snapshot(self):
+        return self.tester.take_snapshot()
+
+    def revert(self, snapshot_id):
+        self.tester.revert_to_snapshot(snapshot_id)
+        self._queued.clear()
+        self.intercept = None
+        self.requests.clear()
+
+    def serve(self):
+        """Start serving JSON-RPC on a free localhost port and return its URL."""
+        evm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                reply = [evm.handle(item) for item in body] if isinstance(body, list) else evm.handle(body)
+                data = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
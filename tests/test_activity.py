@@ -0,0 +1,17 @@
+import sqlite3
+import utils_token
+
+def test_full_buffer_requests_one_flush_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_token, 'DB_PATH', str(tmp_path / 'bot_data.db'))
+    monkeypatch.setattr(utils_token, 'ACTIVITY_FLUSH_THRESHOLD', 2)
+    monkeypatch.setattr(utils_token, '_activity_buffer', {})
+    utils_token.init_db()
+
+    assert [utils_token.record_activity(-100, user_id, f'user{user_id}', False) for user_id in range(4)] == [False, True, False, False]
+    assert utils_token.flush_activity_buffer() == 4
+    assert utils_token.record_activity(-100, 4, 'user4', False) is False
+    assert utils_token.record_activity(-100, 5, 'user5', False) is True
+    utils_token.flush_activity_buffer()
+
+    rows = sqlite3.connect(tmp_path / 'bot_data.db').execute('SELECT COUNT(*) FROM bot_data').fetchone()[0]
+    assert rows == 6
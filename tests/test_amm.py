@@ -0,0 +1,58 @@
+import time
+import pytest
+import amm
+
+TOKEN_A = '0x' + '1' * 40
+TOKEN_B = '0x' + '2' * 40
+TOKEN_C = '0x' + '3' * 40
+E18 = 10 ** 18
+
+# (amount in, reserve in, reserve out, expected out): UniswapV2Pair's swap test cases, which the router's
+# getAmountOut reproduces exactly
+SWAP_CASES = [
+    (1 * E18, 5 * E18, 10 * E18, 1662497915624478906),
+    (1 * E18, 10 * E18, 5 * E18, 453305446940074565),
+    (2 * E18, 5 * E18, 10 * E18, 2851015155847869602),
+    (2 * E18, 10 * E18, 5 * E18, 831248957812239453),
+    (1 * E18, 10 * E18, 10 * E18, 906610893880149131),
+    (1 * E18, 100 * E18, 100 * E18, 987158034397061298),
+    (1 * E18, 1000 * E18, 1000 * E18, 996006981039903216),
+]
+
+@pytest.mark.parametrize('amount_in,reserve_in,reserve_out,expected', SWAP_CASES)
+def test_get_amounts_out_matches_the_router(reserves, amount_in, reserve_in, reserve_out, expected):
+    reserves({(TOKEN_A, TOKEN_B): (reserve_in, reserve_out)})
+    assert amm.get_amounts_out(amount_in, [TOKEN_A, TOKEN_B]) == [amount_in, expected]
+    # The same pool quoted in the other direction
+    reserves({(TOKEN_B, TOKEN_A): (reserve_in, reserve_out)})
+    assert amm.get_amounts_out(amount_in, [TOKEN_B, TOKEN_A]) == [amount_in, expected]
+
+def test_router_rounding_on_small_amounts(reserves):
+    # UniswapV2Router02's getAmountsOut(2, path) and getAmountsIn(1, path) over 10000/10000 reserves
+    reserves({(TOKEN_A, TOKEN_B): (10000, 10000)})
+    assert amm.get_amounts_out(2, [TOKEN_A, TOKEN_B]) == [2, 1]
+    assert amm.get_amounts_in(1, [TOKEN_A, TOKEN_B]) == [2, 1]
+    # UniswapV2Library's getAmountOut(2, 100, 100) and getAmountIn(1, 100, 100)
+    assert amm.get_amount_out(2, 100, 100) == 1
+    assert amm.get_amount_in(1, 100, 100) == 2
+
+@pytest.mark.parametrize('amount_in,reserve_in,reserve_out,expected', SWAP_CASES)
+def test_get_amounts_in_is_the_least_input_for_the_output(reserves, amount_in, reserve_in, reserve_out, expected):
+    reserves({(TOKEN_A, TOKEN_B): (reserve_in, reserve_out)})
+    needed = amm.get_amounts_in(expected, [TOKEN_A, TOKEN_B])[0]
+    assert needed <= amount_in
+    assert amm.get_amount_out(needed, reserve_in, reserve_out) >= expected
+    assert amm.get_amount_out(needed - 1, reserve_in, reserve_out) < expected
+
+def test_multi_hop_quotes_chain_each_pair(reserves):
+    reserves({(TOKEN_A, TOKEN_B): (5 * E18, 10 * E18), (TOKEN_B, TOKEN_C): (1000 * E18, 1000 * E18)})
+    amounts = amm.get_amounts_out(E18, [TOKEN_A, TOKEN_B, TOKEN_C])
+    assert amounts == [E18, 1662497915624478906, amm.get_amount_out(1662497915624478906, 1000 * E18, 1000 * E18)]
+    amounts_in = amm.get_amounts_in(amounts[-1], [TOKEN_A, TOKEN_B, TOKEN_C])
+    assert amounts_in[-1] == amounts[-1] and amounts_in[0] <= E18
+
+def test_stale_reserves_are_not_quoted(reserves, monkeypatch):
+    reserves({(TOKEN_A, TOKEN_B): (10000, 10000)})
+    monkeypatch.setattr(amm, '_reserves_at', time.monotonic() - amm.AMM_MAX_STALENESS - 1)
+    with pytest.raises(amm.QuoteUnavailable):
+        amm.get_amounts_out(2, [TOKEN_A, TOKEN_B])
@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from chain import web3
+from tokens import ERC20_ABI
+import disperse
+import receipts
+
+GAS_PRICE = 10 ** 10
+AMOUNT = 10 ** 18
+
+def recipients(count):
+    return [web3.eth.account.create().address for _ in range(count)]
+
+@pytest.fixture
+def token(evm, monkeypatch):
+    """The local token with the local disperse contract configured, two recipients per batch."""
+    monkeypatch.setattr(disperse, 'disperse_contract', web3.eth.contract(address=evm.disperse, abi=disperse.DISPERSE_ABI))
+    monkeypatch.setattr(disperse, 'DISPERSE_MAX_GAS', disperse.DISPERSE_BASE_GAS + 2 * disperse.DISPERSE_GAS_PER_RECIPIENT)
+    monkeypatch.setattr(disperse, 'DISPERSE_CONFIRM_TIMEOUT', 10)
+    return web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await receipts.stop_receipt_watcher()
+    return asyncio.run(main())
+
+def test_disperse_pays_every_batch(evm, token):
+    addresses = recipients(5)
+    tx_hashes, undelivered, unconfirmed = run(disperse.disperse_token(
+        token, evm.sender.address, evm.sender.key, addresses, AMOUNT, GAS_PRICE))
+
+    assert len(tx_hashes) == 3
+    assert undelivered == [] and unconfirmed == []
+    assert [evm.balance_of(evm.token, address) for address in addresses] == [AMOUNT] * 5
+
+def test_failed_send_that_reached_the_node_is_not_retried(evm, token):
+    def time_out_after_forwarding(method, params, forward):
+        reply = forward(method, params)
+        if method == 'eth_sendRawTransaction':
+            return {'error': {'code': -32000, 'message': 'request timed out'}}
+        return reply
+    evm.intercept = time_out_after_forwarding
+
+    addresses = recipients(3)
+    tx_hashes, undelivered, unconfirmed = run(disperse.disperse_token(
+        token, evm.sender.address, evm.sender.key, addresses, AMOUNT, GAS_PRICE))
+
+    assert len(tx_hashes) == 2
+    assert undelivered == [] and unconfirmed == []
+    assert [evm.balance_of(evm.token, address) for address in addresses] == [AMOUNT] * 3
+
+def test_failed_send_that_never_reached_the_node_is_undelivered(evm, token):
+    sends = []
+    def drop_second_send(method, params, forward):
+        if method == 'eth_sendRawTransaction':
+            sends.append(params)
+            if len(sends) == 2:
+                return {'error': {'code': -32000, 'message': 'connection reset'}}
+        return forward(method, params)
+    evm.intercept = drop_second_send
+
+    addresses = recipients(5)
+    tx_hashes, undelivered, unconfirmed = run(disperse.disperse_token(
+        token, evm.sender.address, evm.sender.key, addresses, AMOUNT, GAS_PRICE))
+
+    assert len(tx_hashes) == 1
+    assert undelivered == addresses[2:] and unconfirmed == []
+    assert [evm.balance_of(evm.token, address) for address in addresses] == [AMOUNT] * 2 + [0] * 3
+
+def test_reverted_batch_is_undelivered(evm, token):
+    # Leave the sender enough for one batch only, and answer estimates as if the balance were still there
+    evm.w3.eth.send_transaction({
+        'from': evm.sender.address, 'to': evm.token, 'gas': 100000,
+        'data': token.encodeABI('transfer', [web3.eth.account.create().address, token.functions.balanceOf(evm.sender.address).call() - 3 * AMOUNT])
+    })
+    def stale_estimates(method, params, forward):
+        if method == 'eth_estimateGas':
+            return {'result': hex(200000)}
+        return forward(method, params)
+    evm.intercept = stale_estimates
+
+    addresses = recipients(4)
+    tx_hashes, undelivered, unconfirmed = run(disperse.disperse_token(
+        token, evm.sender.address, evm.sender.key, addresses, AMOUNT, GAS_PRICE))
+
+    assert len(tx_hashes) == 1
+    assert undelivered == addresses[2:] and unconfirmed == []
+    assert [evm.balance_of(evm.token, address) for address in addresses] == [AMOUNT] * 2 + [0] * 2
@@ -0,0 +1,16 @@
+from eth_abi import encode
+import multicall
+
+TOKEN_A = '0x' + '1' * 40
+TOKEN_B = '0x' + '2' * 40
+WALLET = '0x' + '3' * 40
+
+def test_failed_balance_reads_are_none(monkeypatch):
+    monkeypatch.setattr(multicall, 'aggregate', lambda calls: [
+        (True, encode(['uint256'], [5])), (False, b''), (True, encode(['uint256'], [0]))
+    ])
+    assert multicall.get_balances(WALLET, [TOKEN_A, TOKEN_B]) == (5, [None, 0])
+
+def test_failed_native_balance_read_is_none(monkeypatch):
+    monkeypatch.setattr(multicall, 'aggregate', lambda calls: [(False, b''), (True, encode(['uint256'], [7]))])
+    assert multicall.get_balances(WALLET, [TOKEN_A]) == (None, [7])
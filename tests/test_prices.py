@@ -0,0 +1,95 @@
+import asyncio
+import json
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+import prices
+
+class StubCoinGecko:
+    """Answers /simple/price from a {id: usd} table, or with 429 while rate_limited is set."""
+
+    def __init__(self, table):
+        self.table = table
+        self.rate_limited = None  # Retry-After value to send with 429
+        self.requests = []  # Requested id lists
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                ids = parse_qs(urlparse(self.path).query)['ids'][0].split(',')
+                stub.requests.append(ids)
+                if stub.rate_limited is not None:
+                    self.send_response(429)
+                    self.send_header('Retry-After', stub.rate_limited)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                data = json.dumps({coingecko_id: {'usd': stub.table[coingecko_id]} for coingecko_id in ids if coingecko_id in stub.table}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/simple/price'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def coingecko(monkeypatch):
+    stub = StubCoinGecko({'avalanche-2': 25.5, 'pepe': 0.000001})
+    monkeypatch.setattr(prices, 'COINGECKO_API_URL', stub.url)
+    monkeypatch.setattr(prices, '_prices', prices.TTLCache(maxsize=prices.PRICE_CACHE_SIZE, ttl=prices.PRICE_MAX_STALENESS))
+    monkeypatch.setattr(prices, '_extra_ids', set())
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+def refresh():
+    async def main():
+        try:
+            await prices.refresh_prices()
+        finally:
+            await prices.stop_price_service()
+    asyncio.run(main())
+
+def test_every_tracked_id_is_fetched_in_one_request(coingecko):
+    assert prices.get_usd_price('pepe') is None
+    refresh()
+    assert coingecko.requests == [['avalanche-2', 'pepe']]
+    assert prices.get_usd_price('pepe') == Decimal('0.000001')
+    assert prices.get_usd_price('avalanche-2') == Decimal('25.5')
+
+def test_missing_coingecko_id_is_not_tracked(coingecko):
+    assert prices.get_usd_price(None) is None
+    assert prices.get_usd_price('') is None
+    refresh()
+    assert coingecko.requests == [['avalanche-2']]
+
+def test_rate_limit_reports_retry_after(coingecko):
+    coingecko.rate_limited = '30'
+    with pytest.raises(prices.RateLimited) as raised:
+        refresh()
+    assert raised.value.retry_after == 30.0
+    assert prices.get_usd_price('avalanche-2') is None
+
+@pytest.fixture
+def onchain(monkeypatch):
+    monkeypatch.setattr(prices, '_onchain_prices', prices.TTLCache(maxsize=prices.PRICE_CACHE_SIZE, ttl=prices.PRICE_MAX_STALENESS))
+    monkeypatch.setattr(prices, 'list_tokens', lambda: [])
+
+def test_onchain_price_is_the_reserves_mid_price(reserves, onchain):
+    # 1,000 AVAX against 25,000 USDC: selling one AVAX would return less than 25 after the fee and price impact
+    reserves({(prices.WAVAX_ADDRESS, prices.USD_STABLECOIN_ADDRESS): (1000 * 10 ** 18, 25000 * 10 ** 6)})
+    assert prices.refresh_onchain_prices() == 0
+    assert prices._onchain_prices.get(prices.WAVAX_ADDRESS) == Decimal(25)
+
+def test_onchain_price_falls_back_to_the_router(onchain, monkeypatch):
+    monkeypatch.setattr(prices, 'best_route', lambda amount_in, token_in, token_out: ([token_in, token_out], [amount_in, 24 * 10 ** 6]))
+    assert prices.refresh_onchain_prices() == 0
+    assert prices._onchain_prices.get(prices.WAVAX_ADDRESS) == Decimal(24)
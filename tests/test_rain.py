@@ -0,0 +1,135 @@
+import asyncio
+import rlp
+from chain import web3
+from tokens import ERC20_ABI
+from preflight import rain_preflight
+import rain
+import receipts
+
+GAS_PRICE = 10 ** 10
+AMOUNT = 10 ** 18
+
+def recipients(count):
+    return [(index, f'user{index}', web3.eth.account.create().address) for index in range(count)]
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await receipts.stop_receipt_watcher()
+    return asyncio.run(main())
+
+async def mined(outcomes):
+    watches = [await receipts.watch_transaction(tx_hash, timeout=10) for recipient, tx_hash in outcomes]
+    return await asyncio.gather(*watches)
+
+def test_preflight_gas_covers_recipients_without_a_balance(evm):
+    token = web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+    holder = web3.eth.account.create().address
+    evm.w3.eth.send_transaction({'from': evm.sender.address, 'to': evm.token, 'gas': 100000,
+                                 'data': token.encodeABI('transfer', [holder, AMOUNT])})
+    to_holder = token.functions.transfer(holder, AMOUNT).estimate_gas({'from': evm.sender.address})
+
+    preflight = rain_preflight(evm.token, evm.sender.address, AMOUNT)
+    assert preflight.transfer_gas > to_holder + 10000
+
+    gas_limit = int(preflight.transfer_gas * rain.RAIN_GAS_HEADROOM)
+    wallet = {'address': evm.sender.address, 'private_key': evm.sender.key}
+    users = recipients(3)
+
+    async def main():
+        outcomes, unconfirmed = await rain.send_individual_transfers(token, wallet, users, AMOUNT, gas_limit, GAS_PRICE)
+        return await mined(outcomes)
+
+    assert [receipt.status for receipt in run(main())] == [1, 1, 1]
+    assert [evm.balance_of(evm.token, address) for user_id, username, address in users] == [AMOUNT] * 3
+
+def refuse_transfer(nonce, attempts=None):
+    """Intercept that fails broadcasts of the first transaction sent with nonce: every time, or its first attempts."""
+    refused = {}  # raw transaction -> times refused
+    def intercept(method, params, forward):
+        if method == 'eth_sendRawTransaction':
+            raw_tx = params[0]
+            if not refused and rlp.decode(bytes.fromhex(raw_tx[2:]))[0] == nonce.to_bytes(1, 'big'):
+                refused[raw_tx] = 0
+            if raw_tx in refused and (attempts is None or refused[raw_tx] < attempts):
+                refused[raw_tx] += 1
+                return {'error': {'code': -32000, 'message': 'connection reset'}}
+        return forward(method, params)
+    return intercept
+
+def test_failed_nonce_is_filled_so_later_transfers_are_mined(evm):
+    token = web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+    wallet = {'address': evm.sender.address, 'private_key': evm.sender.key}
+    users = recipients(3)
+    first_nonce = web3.eth.get_transaction_count(evm.sender.address, 'pending')
+    evm.intercept = refuse_transfer(first_nonce + 1)
+
+    async def main():
+        outcomes, unconfirmed = await rain.send_individual_transfers(token, wallet, users, AMOUNT, 100000, GAS_PRICE)
+        assert unconfirmed == []
+        return outcomes, await mined([outcome for outcome in outcomes if outcome[1] is not None])
+
+    outcomes, sent = run(main())
+    assert [tx_hash is not None for user, tx_hash in outcomes] == [True, False, True]
+    assert [receipt.status for receipt in sent] == [1, 1]
+    assert web3.eth.get_transaction_count(evm.sender.address) == first_nonce + 3
+    assert [evm.balance_of(evm.token, address) for user_id, username, address in users] == [AMOUNT, 0, AMOUNT]
+
+def test_failed_send_is_retried(evm):
+    token = web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+    wallet = {'address': evm.sender.address, 'private_key': evm.sender.key}
+    users = recipients(3)
+    evm.intercept = refuse_transfer(web3.eth.get_transaction_count(evm.sender.address, 'pending'), attempts=1)
+
+    outcomes, unconfirmed = run(rain.send_individual_transfers(token, wallet, users, AMOUNT, 100000, GAS_PRICE))
+    assert all(tx_hash is not None for user, tx_hash in outcomes) and unconfirmed == []
+    assert [evm.balance_of(evm.token, address) for user_id, username, address in users] == [AMOUNT] * 3
+
+def test_transfers_behind_an_unfilled_nonce_are_unconfirmed(evm, monkeypatch):
+    token = web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+    wallet = {'address': evm.sender.address, 'private_key': evm.sender.key}
+    users = recipients(4)
+    first_nonce = web3.eth.get_transaction_count(evm.sender.address, 'pending')
+    evm.intercept = refuse_transfer(first_nonce + 1)
+
+    # Nor can the nonce be filled, e.g. the wallet has no AVAX left for the no-op
+    async def fail_fill(*args):
+        return False
+    monkeypatch.setattr(rain, '_fill_nonce', fail_fill)
+
+    outcomes, unconfirmed = run(rain.send_individual_transfers(token, wallet, users, AMOUNT, 100000, GAS_PRICE))
+    assert [tx_hash is not None for user, tx_hash in outcomes] == [True, False, False, False]
+    assert unconfirmed == users[2:]
+
+    # The node kept them queued: the wallet's next transaction takes the free nonce and they are mined
+    evm.intercept = None
+    signed = web3.eth.account.sign_transaction({
+        'to': evm.sender.address, 'value': 0, 'gas': 21000, 'gasPrice': GAS_PRICE,
+        'nonce': web3.eth.get_transaction_count(evm.sender.address, 'pending'), 'chainId': 43114
+    }, evm.sender.key)
+    web3.eth.send_raw_transaction(signed.rawTransaction)
+    assert [evm.balance_of(evm.token, address) for user_id, username, address in users] == [AMOUNT, 0, AMOUNT, AMOUNT]
+
+def test_ambiguous_send_is_unconfirmed_and_never_filled(evm, monkeypatch):
+    token = web3.eth.contract(address=evm.token, abi=ERC20_ABI)
+    wallet = {'address': evm.sender.address, 'private_key': evm.sender.key}
+    users = recipients(3)
+    refuse = refuse_transfer(web3.eth.get_transaction_count(evm.sender.address, 'pending') + 1)
+    def node_unreachable_after_refusal(method, params, forward):
+        if method == 'eth_getTransactionByHash':
+            return {'error': {'code': -32000, 'message': 'connection reset'}}
+        return refuse(method, params, forward)
+    evm.intercept = node_unreachable_after_refusal
+
+    fills = []
+    async def record_fill(*args):
+        fills.append(args)
+        return True
+    monkeypatch.setattr(rain, '_fill_nonce', record_fill)
+
+    outcomes, unconfirmed = run(rain.send_individual_transfers(token, wallet, users, AMOUNT, 100000, GAS_PRICE))
+    assert [tx_hash is not None for user, tx_hash in outcomes] == [True, False, False]
+    assert unconfirmed == users[1:]
+    assert fills == []
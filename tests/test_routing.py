@@ -0,0 +1,38 @@
+from eth_abi import encode
+from web3 import Web3
+import routing
+
+TOKEN = '0x' + '1' * 40
+WAVAX = routing.WAVAX_ADDRESS
+
+def router_answers(monkeypatch, amounts):
+    """Make the router multicall answer getAmountsOut with amounts for every path."""
+    calls = []
+    def aggregate(batch):
+        calls.append(batch)
+        return [(True, encode(['uint256[]'], [amounts])) for target, data in batch]
+    monkeypatch.setattr(routing, 'aggregate', aggregate)
+    return calls
+
+def test_cached_reserves_quote_without_the_router(reserves, monkeypatch):
+    reserves({(TOKEN, WAVAX): (10000, 10000)})
+    calls = router_answers(monkeypatch, [2, 99])
+    assert routing.best_route(2, TOKEN, WAVAX) == ([Web3.to_checksum_address(TOKEN), WAVAX], [2, 1])
+    assert calls == []
+
+def test_fresh_route_is_priced_by_the_router(reserves, monkeypatch):
+    # The cached reserves are fresh enough for display, but a swap's minimum output comes from the chain
+    reserves({(TOKEN, WAVAX): (10000, 10000)})
+    calls = router_answers(monkeypatch, [2, 99])
+    path, amounts = routing.best_route(2, TOKEN, WAVAX, fresh=True)
+    assert amounts == [2, 99]
+    assert len(calls) == 1
+
+def test_token_price_quotes_one_whole_token(reserves, monkeypatch):
+    from types import SimpleNamespace
+    from utils_token import fetch_token_price_in_avax
+    # 1,000 tokens of 6 decimals against 10 AVAX: one token is worth about 0.01 AVAX
+    reserves({(TOKEN, WAVAX): (1000 * 10 ** 6, 10 * 10 ** 18)})
+    router_answers(monkeypatch, [0, 0])
+    price = fetch_token_price_in_avax(SimpleNamespace(address=TOKEN, decimals=6))
+    assert 0.0098 < price < 0.01
@@ -0,0 +1,104 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+from rpc_pool import RPCPool, PooledProvider
+
+RAW_TX = '0x' + 'ab' * 100
+TX_HASH = '0x' + keccak(bytes.fromhex(RAW_TX[2:])).hex()
+
+class StubNode:
+    """A JSON-RPC endpoint answering from a {method: result or callable(params)} table after an optional delay."""
+
+    def __init__(self, answers, delay=0.0):
+        self.answers = answers
+        self.delay = delay
+        self.received = []  # Methods, in order
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                node.received.append(request['method'])
+                time.sleep(node.delay)
+                answer = node.answers[request['method']]
+                reply = answer(request['params']) if callable(answer) else {'result': answer}
+                data = json.dumps({'jsonrpc': '2.0', 'id': request['id'], **reply}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def nodes():
+    started = []
+    def start(answers, delay=0.0):
+        node = StubNode(answers, delay)
+        started.append(node)
+        return node
+    yield start
+    for node in started:
+        node.close()
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+def pooled_web3(*urls):
+    pool = RPCPool(list(urls), requests.Session(), timeout=0.5, hedge_delay=0.05)
+    return Web3(PooledProvider(pool))
+
+def test_reads_fail_over_after_a_timeout(nodes):
+    slow = nodes({'eth_blockNumber': '0x1'}, delay=0.7)
+    fast = nodes({'eth_blockNumber': '0x2'})
+    assert pooled_web3(slow.url, fast.url).eth.block_number == 2
+    assert fast.received == ['eth_blockNumber']
+
+def test_write_is_not_resent_after_a_timeout(nodes):
+    slow = nodes({'eth_sendRawTransaction': TX_HASH}, delay=0.7)
+    other = nodes({'eth_sendRawTransaction': TX_HASH})
+    with pytest.raises(requests.ReadTimeout):
+        pooled_web3(slow.url, other.url).eth.send_raw_transaction(RAW_TX)
+    assert other.received == []
+
+def test_write_fails_over_when_no_connection_was_made(nodes):
+    node = nodes({'eth_sendRawTransaction': TX_HASH})
+    assert pooled_web3(closed_port_url(), node.url).eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
+    assert node.received == ['eth_sendRawTransaction']
+
+@pytest.mark.parametrize('error', ['already known', 'nonce too low'])
+def test_resend_of_a_known_transaction_is_success(nodes, error):
+    def get_transaction(params):
+        return {'result': {'hash': params[0]} if params[0] == TX_HASH else None}
+    node = nodes({
+        'eth_sendRawTransaction': lambda params: {'error': {'code': -32000, 'message': error}},
+        'eth_getTransactionByHash': get_transaction
+    })
+    assert pooled_web3(node.url).eth.send_raw_transaction(RAW_TX) == HexBytes(TX_HASH)
+
+def test_nonce_too_low_for_another_transaction_is_an_error(nodes):
+    node = nodes({
+        'eth_sendRawTransaction': lambda params: {'error': {'code': -32000, 'message': 'nonce too low'}},
+        'eth_getTransactionByHash': None
+    })
+    with pytest.raises(ValueError, match='nonce too low'):
+        pooled_web3(node.url).eth.send_raw_transaction(RAW_TX)
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import threading
+from typing import NamedTuple, Optional
+from eth_abi import decode
+from web3 import Web3
+from dotenv import load_dotenv
+from chain import web3
+from multicall import aggregate
+
+# Load environment variables from .env
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# The ERC-20 functions the bot calls, used when no ABI is configured for a token
+ERC20_ABI = [
+    {'name': 'decimals', 'type': 'function', 'stateMutability': 'view', 'inputs': [], 'outputs': [{'name': '', 'type': 'uint8'}]},
+    {'name': 'balanceOf', 'type': 'function', 'stateMutability': 'view', 'inputs': [{'name': 'account', 'type': 'address'}], 'outputs': [{'name': '', 'type': 'uint256'}]},
+    {'name': 'allowance', 'type': 'function', 'stateMutability': 'view', 'inputs': [{'name': 'owner', 'type': 'address'}, {'name': 'spender', 'type': 'address'}], 'outputs': [{'name': '', 'type': 'uint256'}]},
+    {'name': 'transfer', 'type': 'function', 'stateMutability': 'nonpayable', 'inputs': [{'name': 'to', 'type': 'address'}, {'name': 'amount', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]},
+    {'name': 'approve', 'type': 'function', 'stateMutability': 'nonpayable', 'inputs': [{'name': 'spender', 'type': 'address'}, {'name': 'amount', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]},
+    {'name': 'transferFrom', 'type': 'function', 'stateMutability': 'nonpayable', 'inputs': [{'name': 'from', 'type': 'address'}, {'name': 'to', 'type': 'address'}, {'name': 'amount', 'type': 'uint256'}], 'outputs': [{'name': '', 'type': 'bool'}]}
+]
+
+# ERC-20 decimals() selector
+DECIMALS_SELECTOR = bytes.fromhex('313ce567')
+
+class TokenInfo(NamedTuple):
+    name: str
+    address: str  # Checksummed
+    abi: list
+    contract: object
+    decimals: int
+    coingecko_id: Optional[str]
+
+_registry = None
+_registry_lock = threading.Lock()
+_unavailable = set()  # Configured tokens left out of the registry because their decimals are unknown
+
+def _configured_tokens():
+    """Yield (name, address, abi_json, coingecko_id, decimals) for every token in the environment."""
+    # Tokens listed by name, e.g. TOKENS=rpepe,balln,nochill
+    for name in os.getenv('TOKENS', 'rpepe,balln,nochill').split(','):
+        name = name.strip().lower()
+        if name:
+            yield (name, os.getenv(f'{name.upper()}_TOKEN_CONTRACT_ADDRESS'), os.getenv(f'TOKEN_ABI_{name.upper()}'),
+                   os.getenv(f'COINGECKO_ID_{name}'), os.getenv(f'{name.upper()}_DECIMALS'))
+
+    # Legacy token_1..token_3 names used by the leaderboard and older commands
+    for index in (1, 2, 3):
+        yield (f'token_{index}', os.getenv(f'TOKEN_{index}_CONTRACT_ADDRESS'), os.getenv(f'TOKEN_ABI_TOKEN_{index}'),
+               os.getenv(f'COINGECKO_ID_token_{index}'), os.getenv(f'TOKEN_{index}_DECIMALS'))
+
+def _fetch_decimals(addresses):
+    """Fetch decimals() for all addresses in one Multicall3 call; failed reads are None, never a guess."""
+    try:
+        results = aggregate([(address, DECIMALS_SELECTOR) for address in addresses])
+    except Exception as e:
+        logger.error(f"Error fetching token decimals: {e}")
+        return [None] * len(addresses)
+    return [decode(['uint8'], data)[0] if success and len(data) >= 32 else None for success, data in results]
+
+def load_tokens():
+    """Build the token registry from the environment and swap it in atomically.
+
+    A token whose decimals cannot be read is left out rather than assumed to have 18, since a wrong
+    guess scales every amount by a power of ten; on reload its previously known decimals are kept.
+    """
+    global _registry, _unavailable
+    entries = []
+    for name, address, abi_json, coingecko_id, decimals in _configured_tokens():
+        if not address:
+            continue
+        try:
+            abi = json.loads(abi_json) if abi_json else ERC20_ABI
+            entries.append((name, Web3.to_checksum_address(address), abi or ERC20_ABI, coingecko_id,
+                            int(decimals) if decimals else None))
+        except Exception as e:
+            logger.error(f"Skipping misconfigured token {name}: {e}")
+
+    # Resolve missing decimals with a single batched call
+    unknown = [address for name, address, abi, coingecko_id, decimals in entries if decimals is None]
+    fetched = dict(zip(unknown, _fetch_decimals(unknown))) if unknown else {}
+    known = {token.address: token.decimals for token in (_registry or {}).values()}
+
+    registry = {}
+    unavailable = set()
+    for name, address, abi, coingecko_id, decimals in entries:
+        if decimals is None:
+            decimals = fetched.get(address) if fetched.get(address) is not None else known.get(address)
+        if decimals is None:
+            logger.error(f"Leaving out token {name}: its decimals could not be read. Set {name.upper()}_DECIMALS to configure them.")
+            unavailable.add(name)
+            continue
+        registry[name] = TokenInfo(
+            name=name,
+            address=address,
+            abi=abi,
+            contract=web3.eth.contract(address=address, abi=abi),
+            decimals=decimals,
+            coingecko_id=coingecko_id
+        )
+
+    with _registry_lock:
+        _registry = registry
+        _unavailable = unavailable
+    logger.info(f"Token registry loaded: {', '.join(registry) or 'no tokens'}.")
+    return registry
+
+def reload_tokens():
+    """Re-read .env and rebuild the registry, e.g. after adding a token."""
+    load_dotenv(override=True)
+    return load_tokens()
+
+def _get_registry():
+    if _registry is None:
+        with _registry_lock:
+            loaded = _registry is not None
+        if not loaded:
+            load_tokens()
+    return _registry
+
+def get_token(name):
+    """Look up a token by name; raises ValueError for unknown tokens."""
+    token = _get_registry().get(name.lower())
+    if token is None:
+        if name.lower() in _unavailable:
+            raise ValueError(f"Token {name} is unavailable: its decimals could not be read.")
+        logger.error(f"Unsupported token: {name}")
+        raise ValueError(f"Unsupported or unknown token: {name}")
+    return token
+
+def list_tokens():
+    """Return every registered token except the legacy token_N aliases, in configuration order."""
+    return [token for name, token in _get_registry().items() if not name.startswith('token_')]
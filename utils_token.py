@@ -1,11 +1,16 @@
 import json
 import os
-import sqlite3
 from decimal import Decimal
 from web3 import Web3
 import logging
+import threading
+import time
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
+from chain import web3, WAVAX_ADDRESS
+from routing import best_route
+from db import DB_PATH, WALLETS_DB_PATH, get_connection
+import activity_index
+from cache import TTLCache
 
 # Load environment variables from .env
 load_dotenv()
@@ -24,177 +29,304 @@ logger = logging.getLogger(__name__)
 # Example of logging a function activity
 logger.info("Utilities loaded successfully.")
 
-# Environment variables for token contract addresses and RPC URL
-TOKEN_1_CONTRACT_ADDRESS = os.getenv('TOKEN_1_CONTRACT_ADDRESS')
-TOKEN_2_CONTRACT_ADDRESS = os.getenv('TOKEN_2_CONTRACT_ADDRESS')
-TOKEN_3_CONTRACT_ADDRESS = os.getenv('TOKEN_3_CONTRACT_ADDRESS')
-AVALANCHE_RPC = os.getenv('AVALANCHE_RPC')
-ROUTER_CONTRACT_ADDRESS = os.getenv('ROUTER_CONTRACT_ADDRESS')
+# Write-behind buffer for user activity, keyed by (chat_id, user_id)
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv('ACTIVITY_FLUSH_INTERVAL', '5'))  # Seconds between flushes
+ACTIVITY_FLUSH_THRESHOLD = int(os.getenv('ACTIVITY_FLUSH_THRESHOLD', '500'))  # Pending rows that force a flush
+_activity_buffer = {}
+_activity_lock = threading.Lock()
+_flush_scheduled = False  # A threshold flush has been handed to the executor and has not started yet
 
-# Initialize Web3
-web3 = Web3(Web3.HTTPProvider(AVALANCHE_RPC))
+# How long user activity is kept, in hours, and how the retention job deletes expired rows
+ACTIVITY_RETENTION_HOURS = 24
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '600'))  # Seconds between retention runs
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))  # Rows deleted per transaction
 
-# Check if Web3 is connected to the Avalanche network
-if not web3.is_connected():
-    logger.error("Failed to connect to Avalanche network via Web3. Check your RPC URL.")
-else:
-    logger.info("Successfully connected to Avalanche network via Web3.")
+# Cache for wallet lookups; wallet rows almost never change and saves invalidate their entry
+WALLET_CACHE_SIZE = int(os.getenv('WALLET_CACHE_SIZE', '10000'))
+WALLET_CACHE_TTL = int(os.getenv('WALLET_CACHE_TTL', '3600'))  # Seconds
+_wallet_cache = TTLCache(WALLET_CACHE_SIZE, WALLET_CACHE_TTL)
+_NO_WALLET = object()  # Cached marker for users without a wallet
 
-# Load router ABI from environment variable
-ROUTER_ABI = json.loads(os.getenv('ROUTER_ABI', '[]'))
-router_contract = web3.eth.contract(address=ROUTER_CONTRACT_ADDRESS, abi=ROUTER_ABI)
-
-# SQLite Database paths
-DB_PATH = 'bot_data.db'
-WALLETS_DB_PATH = 'wallets.db'
+# bot_data schema version, tracked with PRAGMA user_version
+BOT_DATA_SCHEMA_VERSION = 2
 
 # Initialize SQLite Database for bot data
 def init_db():
-    """Initialize the SQLite database for storing bot data."""
+    """Initialize the SQLite database for storing bot data, migrating older schemas."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Create the bot_data table if it doesn't exist
-        c.execute('''CREATE TABLE IF NOT EXISTS bot_data (
-                        chat_id TEXT,
-                        user_id TEXT,
-                        username TEXT,
-                        last_active TEXT,
-                        is_bot INTEGER,
-                        PRIMARY KEY (chat_id, user_id)
-                    )''')
-        conn.commit()
+        conn = get_connection(DB_PATH)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < BOT_DATA_SCHEMA_VERSION:
+            migrate_bot_data(conn)
         logger.info("Database initialized successfully.")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
-    finally:
-        conn.close()
+
+# Migrate bot_data to integer ids and epoch timestamps
+def migrate_bot_data(conn):
+    """Create the indexed bot_data schema, copying rows over from the legacy TEXT-based table if present."""
+    legacy_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bot_data'"
+    ).fetchone() is not None
+
+    conn.execute('BEGIN')
+    with conn:
+        # last_active is stored as Unix epoch seconds (UTC)
+        conn.execute('''CREATE TABLE bot_data_new (
+                            chat_id INTEGER NOT NULL,
+                            user_id INTEGER NOT NULL,
+                            username TEXT,
+                            last_active INTEGER NOT NULL,
+                            is_bot INTEGER NOT NULL DEFAULT 0,
+                            PRIMARY KEY (chat_id, user_id)
+                        ) WITHOUT ROWID''')
+        if legacy_exists:
+            conn.execute('''INSERT OR REPLACE INTO bot_data_new (chat_id, user_id, username, last_active, is_bot)
+                            SELECT CAST(chat_id AS INTEGER), CAST(user_id AS INTEGER), username,
+                                   CAST(strftime('%s', last_active) AS INTEGER), COALESCE(is_bot, 0)
+                            FROM bot_data
+                            WHERE strftime('%s', last_active) IS NOT NULL''')
+            conn.execute('DROP TABLE bot_data')
+        conn.execute('ALTER TABLE bot_data_new RENAME TO bot_data')
+
+        # Covering index for get_active_users (user_id comes with the primary key)
+        conn.execute('CREATE INDEX idx_bot_data_chat_active ON bot_data (chat_id, last_active, is_bot, username)')
+        # Range index for retention deletes
+        conn.execute('CREATE INDEX idx_bot_data_last_active ON bot_data (last_active)')
+        conn.execute(f'PRAGMA user_version = {BOT_DATA_SCHEMA_VERSION}')
+
+    migrated = conn.execute('SELECT COUNT(*) FROM bot_data').fetchone()[0]
+    logger.info(f"bot_data migrated to schema version {BOT_DATA_SCHEMA_VERSION} ({migrated} rows).")
 
 # Save bot_data to SQLite
 def save_bot_data(chat_id, user_id, username, is_bot, last_active=None):
-    """Save or update user activity data in the database."""
+    """Save or update user activity data in the database. last_active is in epoch seconds."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-
         if last_active is None:
-            last_active = datetime.now(timezone.utc).isoformat()
+            last_active = int(time.time())
 
-        c.execute('''INSERT OR REPLACE INTO bot_data (chat_id, user_id, username, last_active, is_bot)
-                     VALUES (?, ?, ?, ?, ?)''', 
-                  (str(chat_id), str(user_id), username, last_active, int(is_bot)))
-        conn.commit()
+        conn = get_connection(DB_PATH)
+        with conn:
+            conn.execute('''INSERT OR REPLACE INTO bot_data (chat_id, user_id, username, last_active, is_bot)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (int(chat_id), int(user_id), username, int(last_active), int(is_bot)))
 
         logger.info(f"Bot data for {username} ({user_id}) in chat {chat_id} saved successfully.")
     except Exception as e:
         logger.error(f"Error saving bot_data: {e}")
-    finally:
-        conn.close()
 
-# Load active users from SQLite within the last X hours
+# Buffer user activity in memory until the next flush
+def record_activity(chat_id, user_id, username, is_bot):
+    """Record a user's latest activity; only the newest timestamp per (chat_id, user_id) is kept.
+
+    Returns True when the buffer has reached ACTIVITY_FLUSH_THRESHOLD and the caller should run
+    flush_activity_buffer off the event loop; only one such flush is requested at a time.
+    """
+    global _flush_scheduled
+    last_active = int(time.time())
+    with _activity_lock:
+        _activity_buffer[(int(chat_id), int(user_id))] = (username, last_active, int(is_bot))
+        flush_due = len(_activity_buffer) >= ACTIVITY_FLUSH_THRESHOLD and not _flush_scheduled
+        if flush_due:
+            _flush_scheduled = True
+    activity_index.touch(int(chat_id), int(user_id), username, is_bot, last_active)
+    return flush_due
+
+# Flush buffered activity to SQLite in one transaction
+def flush_activity_buffer():
+    """Write all buffered activity to bot_data with a single executemany and return the row count."""
+    global _activity_buffer, _flush_scheduled
+    with _activity_lock:
+        _flush_scheduled = False
+        if not _activity_buffer:
+            return 0
+        pending, _activity_buffer = _activity_buffer, {}
+
+    rows = [(chat_id, user_id, username, last_active, is_bot)
+            for (chat_id, user_id), (username, last_active, is_bot) in pending.items()]
+    try:
+        conn = get_connection(DB_PATH)
+        with conn:
+            conn.executemany('''INSERT OR REPLACE INTO bot_data (chat_id, user_id, username, last_active, is_bot)
+                                VALUES (?, ?, ?, ?, ?)''', rows)
+
+        logger.debug(f"Flushed {len(rows)} buffered activity rows to bot_data.")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error flushing activity buffer: {e}")
+        # Put the rows back unless newer activity has been recorded in the meantime
+        with _activity_lock:
+            for key, value in pending.items():
+                _activity_buffer.setdefault(key, value)
+        return 0
+
+# Seed the in-memory activity index from SQLite
+def load_activity_index():
+    """Load activity from the retention window into the in-memory index; call once at startup."""
+    cutoff_time = int(time.time()) - ACTIVITY_RETENTION_HOURS * 3600
+    try:
+        conn = get_connection(DB_PATH)
+        rows = conn.execute('''SELECT chat_id, user_id, username, last_active, is_bot FROM bot_data
+                               WHERE last_active >= ? ORDER BY last_active''', (cutoff_time,))
+        return activity_index.seed(rows)
+    except Exception as e:
+        logger.error(f"Error loading activity index: {e}")
+        return 0
+
+# Load active users within the last X hours
 def get_active_users(chat_id, hours):
-    """Retrieve users active in the last X hours in a specific chat."""
-    now = datetime.now(timezone.utc)
-    cutoff_time = now - timedelta(hours=hours)
+    """Retrieve users active in the last X hours in a specific chat from the in-memory activity index."""
+    chat_id = int(chat_id)
+    cutoff_time = int(time.time()) - int(hours * 3600)
+    active_users = [(str(user_id), username) for user_id, username in activity_index.active_users(chat_id, cutoff_time)]
+
+    logger.info(f"Active users in the last {hours} hours in chat {chat_id}: {active_users}")
+    return active_users
+
+# Load rain recipients: active users joined with their wallets
+def get_rain_recipients(chat_id, hours, exclude_user_id=None):
+    """Return [(user_id, username, address)] for non-bot users active in the last X hours that have a wallet.
+
+    The active set comes from the in-memory activity index and is joined against the wallets table
+    in a single statement, regardless of how many users were active.
+    """
+    chat_id = int(chat_id)
+    cutoff_time = int(time.time()) - int(hours * 3600)
+    active_users = dict(activity_index.active_users(chat_id, cutoff_time))
+    if not active_users:
+        return []
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Query for users active in the last X hours
-        c.execute('''SELECT user_id, username FROM bot_data
-                     WHERE chat_id = ? AND last_active >= ? AND is_bot = 0''',
-                  (str(chat_id), cutoff_time.isoformat()))
-        active_users = c.fetchall()
-
-        logger.info(f"Active users in the last {hours} hours in chat {chat_id}: {active_users}")
-        return active_users
+        conn = get_connection(WALLETS_DB_PATH)
+        rows = conn.execute('''SELECT w.user_id, w.address FROM wallets AS w
+                               JOIN json_each(?) AS active ON w.user_id = CAST(active.value AS TEXT)
+                               WHERE w.user_id != ? AND length(w.address) > 0''',
+                            (json.dumps(list(active_users)), str(exclude_user_id))).fetchall()
     except Exception as e:
-        logger.error(f"Error fetching active users: {e}")
+        logger.error(f"Error fetching rain recipients: {e}")
         return []
-    finally:
-        conn.close()
 
-# Clean up bot_data older than 24 hours
+    recipients = [(user_id, active_users[int(user_id)], address) for user_id, address in rows
+                  if active_users[int(user_id)]]
+    logger.info(f"Rain recipients in the last {hours} hours in chat {chat_id}: {len(recipients)} of {len(active_users)} active users")
+    return recipients
+
+# Clean up bot_data older than the retention window
 def clean_old_data():
-    """Clean up bot activity data older than 24 hours."""
-    now = datetime.now(timezone.utc)
-    cutoff_time = now - timedelta(hours=24)
+    """Delete activity older than ACTIVITY_RETENTION_HOURS in bounded batches and return (rows_removed, seconds)."""
+    started = time.monotonic()
+    cutoff_time = int(time.time()) - ACTIVITY_RETENTION_HOURS * 3600
+    activity_index.prune(cutoff_time)
+
+    removed = 0
+    batches = 0
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Delete entries older than 24 hours
-        c.execute('DELETE FROM bot_data WHERE last_active < ?', (cutoff_time.isoformat(),))
-        conn.commit()
-        logger.info("Old bot_data entries cleaned successfully.")
+        conn = get_connection(DB_PATH)
+        while True:
+            # Each batch is its own short transaction so writers never wait long for the lock
+            with conn:
+                deleted = conn.execute('''DELETE FROM bot_data WHERE (chat_id, user_id) IN (
+                                             SELECT chat_id, user_id FROM bot_data
+                                             WHERE last_active < ? LIMIT ?)''',
+                                       (cutoff_time, RETENTION_BATCH_SIZE)).rowcount
+            removed += deleted
+            batches += 1
+            if deleted < RETENTION_BATCH_SIZE:
+                break
     except Exception as e:
         logger.error(f"Error cleaning old bot_data: {e}")
-    finally:
-        conn.close()
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Removed {removed} expired bot_data rows in {batches} batch(es) in {elapsed * 1000:.1f} ms.")
+    return removed, elapsed
 
 # Wallet management functions
 def get_user_wallet(user_id):
-    """Retrieve a user's wallet from the SQLite database."""
+    """Retrieve a user's wallet, served from the wallet cache when possible."""
+    cached = _wallet_cache.get(str(user_id))
+    if cached is not None:
+        return None if cached is _NO_WALLET else cached
+
     try:
-        conn = sqlite3.connect(WALLETS_DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT address, private_key FROM wallets WHERE user_id = ?', (str(user_id),))
-        wallet = c.fetchone()
+        conn = get_connection(WALLETS_DB_PATH)
+        wallet = conn.execute('SELECT address, private_key FROM wallets WHERE user_id = ?', (str(user_id),)).fetchone()
 
         if wallet:
             logger.debug(f"Wallet found for user {user_id}")
-            return {'address': wallet[0], 'private_key': wallet[1]}
+            wallet = {'address': wallet[0], 'private_key': wallet[1]}
+            _wallet_cache.set(str(user_id), wallet)
+            return wallet
         else:
             logger.info(f"No wallet found for user {user_id}")
+            _wallet_cache.set(str(user_id), _NO_WALLET)
             return None
     except Exception as e:
         logger.error(f"Error loading wallet for user {user_id}: {e}")
         return None
-    finally:
-        conn.close()
 
 def save_wallet(user_id, address, private_key):
     """Save or update a user's wallet in the SQLite database."""
     try:
-        conn = sqlite3.connect(WALLETS_DB_PATH)
-        c = conn.cursor()
-        c.execute('''
-            INSERT OR REPLACE INTO wallets (user_id, address, private_key)
-            VALUES (?, ?, ?)
-        ''', (str(user_id), address, private_key))
-        conn.commit()
+        conn = get_connection(WALLETS_DB_PATH)
+        with conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO wallets (user_id, address, private_key)
+                VALUES (?, ?, ?)
+            ''', (str(user_id), address, private_key))
 
         logger.info(f"Wallet for user {user_id} saved successfully.")
     except Exception as e:
         logger.error(f"Error saving wallet for user {user_id}: {e}")
     finally:
-        conn.close()
-
-# Token contract functions
-def get_token_contract(token):
-    """Returns the appropriate token contract address and ABI."""
-    TOKEN_ABI_TOKEN_1 = json.loads(os.getenv('TOKEN_ABI_TOKEN_1', '[]'))
-    TOKEN_ABI_TOKEN_2 = json.loads(os.getenv('TOKEN_ABI_TOKEN_2', '[]'))
-    TOKEN_ABI_TOKEN_3 = json.loads(os.getenv('TOKEN_ABI_TOKEN_3', '[]'))
-
-    if token == 'token_1':
-        return TOKEN_1_CONTRACT_ADDRESS, TOKEN_ABI_TOKEN_1
-    elif token == 'token_2':
-        return TOKEN_2_CONTRACT_ADDRESS, TOKEN_ABI_TOKEN_2
-    elif token == 'token_3':
-        return TOKEN_3_CONTRACT_ADDRESS, TOKEN_ABI_TOKEN_3
-    else:
-        logger.error(f"Unsupported token: {token}")
-        raise ValueError("Unsupported token")
+        _wallet_cache.invalidate(str(user_id))
+
+def save_wallet_if_absent(user_id, address, private_key):
+    """Store a new wallet unless the user already has one; return (stored wallet, created).
+
+    The insert never replaces an existing row, so two concurrent /getwallet calls cannot overwrite a key
+    that may already hold funds; the second caller gets the wallet that was stored first.
+    """
+    user_id = str(user_id)
+    try:
+        conn = get_connection(WALLETS_DB_PATH)
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO wallets (user_id, address, private_key)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO NOTHING
+            ''', (user_id, address, private_key))
+            created = cursor.rowcount == 1
+        row = conn.execute('SELECT address, private_key FROM wallets WHERE user_id = ?', (user_id,)).fetchone()
+    finally:
+        _wallet_cache.invalidate(user_id)
+
+    if created:
+        logger.info(f"Wallet for user {user_id} saved successfully.")
+    return {'address': row[0], 'private_key': row[1]}, created
+
+def warm_wallet_cache():
+    """Preload up to WALLET_CACHE_SIZE wallets into the cache and return how many were loaded."""
+    try:
+        conn = get_connection(WALLETS_DB_PATH)
+        rows = conn.execute('SELECT user_id, address, private_key FROM wallets LIMIT ?', (WALLET_CACHE_SIZE,))
+        count = 0
+        for user_id, address, private_key in rows:
+            _wallet_cache.set(str(user_id), {'address': address, 'private_key': private_key})
+            count += 1
+        logger.info(f"Wallet cache warmed with {count} wallets.")
+        return count
+    except Exception as e:
+        logger.error(f"Error warming wallet cache: {e}")
+        return 0
 
 # Fetch token price in AVAX
-def fetch_token_price_in_avax(token_address):
-    """Fetches the price of a token in AVAX from the DEX router contract."""
+def fetch_token_price_in_avax(token_info):
+    """Fetches the price of a token in AVAX along its best route, from local pair reserves or the DEX router contract."""
     try:
-        amount_in = Web3.to_wei(1, 'ether')  # 1 Token in wei
-        amounts_out = router_contract.functions.getAmountsOut(
-            amount_in, [web3.to_checksum_address(token_address), web3.to_checksum_address('0xB31f66AA3C1e785363F0875A1B74E27b85FD66c7')]
-        ).call()
+        amount_in = 10 ** token_info.decimals  # 1 whole token in its smallest units
+        path, amounts_out = best_route(amount_in, web3.to_checksum_address(token_info.address), WAVAX_ADDRESS)
 
-        token_price_in_avax = Web3.from_wei(amounts_out[1], 'ether')
+        token_price_in_avax = Web3.from_wei(amounts_out[-1], 'ether')
         return Decimal(token_price_in_avax)
     except Exception as e:
         logger.error(f"Error fetching token price from blockchain: {e}")
@@ -1,10 +1,11 @@
+import asyncio
 import logging
-import sqlite3
 from telegram import Update
 from telegram.ext import CallbackContext, ConversationHandler, CommandHandler, MessageHandler, filters
-from web3 import Web3
 from dotenv import load_dotenv
 import os
+from utils_token import get_user_wallet, save_wallet_if_absent
+from key_pool import create_wallet
 
 # Load environment variables from .env
 load_dotenv()
@@ -18,51 +19,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Get environment variables
-RPC_URL = os.getenv('AVALANCHE_RPC')
-
-# Connect to the blockchain network (generalized as RPC_URL)
-web3 = Web3(Web3.HTTPProvider(RPC_URL))
-
 # Define conversation states
 SHOW_PRIVATE_KEY = range(1)
 
-# SQLite database path for storing wallets
-WALLETS_DB_PATH = 'wallets.db'
-
-# Function to retrieve a wallet from the SQLite database
-def get_user_wallet(user_id):
-    """Retrieve a user's wallet (public and private keys) from the SQLite database."""
-    try:
-        conn = sqlite3.connect(WALLETS_DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT address, private_key FROM wallets WHERE user_id = ?", (user_id,))
-        wallet = c.fetchone()
-        conn.close()
-        logger.debug(f"Fetched wallet for user {user_id}: {wallet}")
-        if wallet:
-            return {'address': wallet[0], 'private_key': wallet[1]}
-        return None
-    except Exception as e:
-        logger.error(f"Error retrieving wallet for user {user_id}: {e}")
-        return None
-
 # Function to save a wallet to the SQLite database
 def save_user_wallet(user_id, address, private_key):
-    """Save or update a user's wallet (public and private keys) in the SQLite database."""
-    try:
-        conn = sqlite3.connect(WALLETS_DB_PATH)
-        c = conn.cursor()
-        logger.debug(f"Saving wallet for user {user_id}: {address}")
-        c.execute('''
-            INSERT OR REPLACE INTO wallets (user_id, address, private_key)
-            VALUES (?, ?, ?)
-        ''', (user_id, address, private_key))
-        conn.commit()
-        conn.close()
-        logger.info(f"Wallet for user {user_id} saved successfully.")
-    except Exception as e:
-        logger.error(f"Error saving wallet for user {user_id}: {e}")
+    """Save a new wallet unless the user already has one; returns (stored wallet, created)."""
+    logger.debug(f"Saving wallet for user {user_id}: {address}")
+    return save_wallet_if_absent(user_id, address, private_key)
 
 # /getwallet command handler
 async def getwallet(update: Update, context: CallbackContext) -> int:
@@ -93,9 +57,19 @@ async def getwallet(update: Update, context: CallbackContext) -> int:
         return SHOW_PRIVATE_KEY  # Move to the state to handle the user's response
     else:
         try:
-            # If no wallet exists, create a new one
-            new_wallet = web3.eth.account.create()
-            save_user_wallet(user_id, new_wallet.address, new_wallet.key.hex())
+            # If no wallet exists, create a new one from the key pool and save it off the event loop
+            new_wallet = await create_wallet()
+            wallet, created = await asyncio.get_running_loop().run_in_executor(
+                None, save_user_wallet, user_id, new_wallet.address, new_wallet.key.hex()
+            )
+
+            # A concurrent /getwallet from the same user stored its wallet first; keep that one
+            if not created:
+                await update.message.reply_text(
+                    f"You already have a wallet, my friend.\n"
+                    f"Your wallet address: {wallet['address']}"
+                )
+                return ConversationHandler.END
 
             logger.debug(f"New wallet created for user {user_id}")
             await update.message.reply_text(
@@ -1,47 +1,166 @@
+import argparse
 import json
-import sqlite3
 import os
+import time
+from db import WALLETS_DB_PATH, get_connection
 
-# Path to the SQLite database and JSON file
-WALLETS_DB_PATH = 'wallets.db'
+# Path to the JSON file exported by older versions of the bot
 WALLETS_JSON_PATH = 'wallets.json'
 
+# Import tuning
+BATCH_SIZE = 5000  # Wallets inserted per transaction
+READ_CHUNK_SIZE = 1024 * 1024  # Characters read from the JSON file at a time
+
 # Initialize SQLite Wallets Database
-def init_wallets_db():
-    conn = sqlite3.connect(WALLETS_DB_PATH)
-    c = conn.cursor()
-    # Create the wallets table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS wallets (
-            user_id TEXT PRIMARY KEY,      -- Unique Telegram user ID
-            address TEXT NOT NULL,         -- Public wallet address
-            private_key TEXT NOT NULL      -- Private key of the wallet
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def init_wallets_db(db_path=WALLETS_DB_PATH):
+    conn = get_connection(db_path)
+    with conn:
+        # Create the wallets table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS wallets (
+                user_id TEXT PRIMARY KEY,      -- Unique Telegram user ID
+                address TEXT NOT NULL,         -- Public wallet address
+                private_key TEXT NOT NULL      -- Private key of the wallet
+            )
+        ''')
+        # Checkpoints so an interrupted migration can resume
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS wallet_migration (
+                source TEXT PRIMARY KEY,       -- Absolute path of the JSON file
+                processed INTEGER NOT NULL     -- Wallets committed so far
+            )
+        ''')
+
+# Stream the top-level {user_id: {...}} object without loading the whole file
+def iter_wallets_json(f, chunk_size=READ_CHUNK_SIZE):
+    """Yield (user_id, wallet_data) pairs from a JSON object, reading the file incrementally."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def next_char():
+        # Skip whitespace and return the next significant character without consuming it
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError("Unexpected end of wallets JSON.")
+            fill()
+
+    def next_value():
+        # A value that ends exactly at the end of the buffer may be truncated, so read more first
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    if next_char() != '{':
+        raise ValueError("Wallets JSON must be an object keyed by user ID.")
+    pos += 1
+    if next_char() == '}':
+        return
+
+    while True:
+        next_char()
+        user_id = next_value()
+        if next_char() != ':':
+            raise ValueError(f"Expected ':' after key {user_id!r} in wallets JSON.")
+        pos += 1
+        next_char()
+        wallet_data = next_value()
+        yield user_id, wallet_data
+
+        separator = next_char()
+        pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '}}' after wallet for {user_id!r}.")
 
 # Migrate data from wallets.json to wallets.db
-def migrate_wallets_json_to_db():
-    if os.path.exists(WALLETS_JSON_PATH):
-        with open(WALLETS_JSON_PATH, 'r') as f:
-            wallets = json.load(f)
-        
-        # Insert wallets into SQLite database
-        conn = sqlite3.connect(WALLETS_DB_PATH)
-        c = conn.cursor()
-        for user_id, wallet_data in wallets.items():
-            c.execute('''
+def migrate_wallets_json_to_db(json_path=WALLETS_JSON_PATH, db_path=WALLETS_DB_PATH, batch_size=BATCH_SIZE, resume=False):
+    """Import wallets in batched transactions and return the number of wallets written."""
+    if not os.path.exists(json_path):
+        print(f"File {json_path} not found.")
+        return 0
+
+    init_wallets_db(db_path)
+    conn = get_connection(db_path)
+    source = os.path.abspath(json_path)
+
+    skip = 0
+    if resume:
+        row = conn.execute('SELECT processed FROM wallet_migration WHERE source = ?', (source,)).fetchone()
+        skip = row[0] if row else 0
+        if skip:
+            print(f"Resuming after {skip} already migrated wallets.")
+
+    processed = 0
+    written = 0
+    batch = []
+    started = time.monotonic()
+
+    def commit_batch():
+        # The checkpoint is written in the same transaction as the wallets it covers
+        nonlocal written
+        with conn:
+            conn.executemany('''
                 INSERT OR REPLACE INTO wallets (user_id, address, private_key)
                 VALUES (?, ?, ?)
-            ''', (user_id, wallet_data['address'], wallet_data['private_key']))
-        conn.commit()
-        conn.close()
+            ''', batch)
+            conn.execute('INSERT OR REPLACE INTO wallet_migration (source, processed) VALUES (?, ?)',
+                         (source, processed))
+        written += len(batch)
+        batch.clear()
+        elapsed = time.monotonic() - started
+        print(f"{processed} wallets migrated ({written / elapsed if elapsed else 0:.0f} wallets/s).")
+
+    with open(json_path, 'r') as f:
+        for user_id, wallet_data in iter_wallets_json(f):
+            processed += 1
+            if processed <= skip:
+                continue
+            batch.append((str(user_id), wallet_data['address'], wallet_data['private_key']))
+            if len(batch) >= batch_size:
+                commit_batch()
+        if batch:
+            commit_batch()
+
+    elapsed = time.monotonic() - started
+    print(f"Wallets migrated from JSON to SQLite successfully: {written} written in {elapsed:.2f}s.")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Create wallets.db and migrate wallets from a JSON export.")
+    parser.add_argument('--json', default=WALLETS_JSON_PATH, help="Path to the wallets JSON export.")
+    parser.add_argument('--db', default=WALLETS_DB_PATH, help="Path to the SQLite wallets database.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Wallets inserted per transaction.")
+    parser.add_argument('--resume', action='store_true', help="Skip wallets committed by a previous, interrupted run.")
+    parser.add_argument('--init-only', action='store_true', help="Only create the database schema.")
+    args = parser.parse_args()
 
-        print("Wallets migrated from JSON to SQLite successfully.")
-    else:
-        print(f"File {WALLETS_JSON_PATH} not found.")
+    init_wallets_db(args.db)
+    if not args.init_only:
+        migrate_wallets_json_to_db(args.json, args.db, args.batch_size, args.resume)
 
-# Call the functions to create the database and migrate the data
-init_wallets_db()
-migrate_wallets_json_to_db()
\ No newline at end of file
+if __name__ == '__main__':
+    main()